@@ -12,6 +12,7 @@
 
 """
 
+import os
 import h5py
 import numpy as np
 import pandas as pd
@@ -24,35 +25,165 @@ file_fmt = 'wyoming_samer_{}_{}.h5'
 colnames = ['pres','hgt','temp','dewp','relh','mixr'
             ,'wdir','sknt','thta','thte','thtv']
 
+# columns of the DataFrames of get_df_year and get_raw
+df_names = ['pres','hght','temp','dewp','relh','mixr'
+            ,'drct','sknt','thta','thte','thtv']
 
-def get_df_year(year, station=None):
+# zarr stores written by wyominglib.download_wyoming(layout='zarr')
+zarr_fmt = 'wyoming_samer_{}.zarr'
+
+# columns of the zarr stores and of the dense hdf files
+# (download_wyoming(layout='dense'))
+zarr_columns = ['pres','hght','temp','dwpt','relh','mixr'
+                ,'drct','sknt','thta','thte','thtv']
+
+
+def is_zarr(station, year):
+
+    """
+    True if the year of station is read from its zarr store: the
+    store exists and holds soundings of that year; otherwise the
+    hdf file of the year is read
+
+    :param station: station name
+    :param year: year
+    """
+
+    path = source + zarr_fmt.format(station)
+    if not os.path.isdir(path):
+        return False
+
+    import zarr
+
+    group = zarr.open_group(path, mode='r')
+    month_rows = group.attrs['month_rows']
+    first = (year - group.attrs['first_year']) * 12 * month_rows
+    if first < 0:
+        return False
+    return bool((group['nlevels'][first:first + 12 * month_rows] > 0).any())
+
+
+def zarr_values(station, year):
+
+    """
+    Soundings of a year in the zarr store of station, one per
+    12-hourly launch like the nodes of the hdf files
+
+    Only the month chunks of the year are read.
+
+    :param station: station name
+    :param year: year
+    :return: list of (time, values) with values as in read_values,
+             None for a launch without sounding
+    """
+
+    import zarr
+
+    group = zarr.open_group(source + zarr_fmt.format(station), mode='r')
+    month_rows = group.attrs['month_rows']
+    first = (year - group.attrs['first_year']) * 12 * month_rows
+    last = first + 12 * month_rows
+
+    times = pd.date_range(start='{}-01-01 00:00'.format(year),
+                          end='{}-12-31 12:00'.format(year), freq='12h')
+    rows = (times.month - 1) * month_rows + 2 * (times.day - 1) + \
+        times.hour // 12
+    nlevels = group['nlevels'][first:last][rows]
+    nlev = nlevels.max(initial=0)
+    block = np.stack([group[name][first:last, :nlev][rows]
+                      for name in zarr_columns], axis=-1)
+
+    out = list()
+    for n, idx in enumerate(times):
+        values = block[n, :nlevels[n]] if nlevels[n] > 0 else None
+        out.append((idx.to_pydatetime(), values))
+    return out
+
+
+def dense_values(f, year):
+
+    """
+    Soundings of a year in a dense hdf file, one per 12-hourly
+    launch like the nodes of the other hdf files
+
+    :param f: h5py File written with layout='dense'
+    :param year: year
+    :return: list of (time, values) with values as in read_values,
+             None for a launch without sounding
+    """
+
+    times = pd.date_range(start='{}-01-01 00:00'.format(year),
+                          end='{}-12-31 12:00'.format(year), freq='12h')
+    rows = {stamp: n for n, stamp in enumerate(f['time'][:].tolist())}
+    nlevels = f['nlevels'][:]
+    block = np.stack([f[name][:] for name in zarr_columns], axis=-1)
+
+    out = list()
+    for idx in times:
+        row = rows.get(idx.value // 10**9)
+        if row is None or nlevels[row] == 0:
+            values = None
+        else:
+            values = block[row, :nlevels[row]]
+        out.append((idx.to_pydatetime(), values))
+    return out
+
+
+def year_values(station, year):
+
+    """
+    Soundings of a year of station, from its zarr store if it
+    holds the year (see is_zarr) and from its hdf file otherwise
+
+    :param station: station name
+    :param year: year
+    :return: list of (time, values) with values as in read_values
+    """
+
+    if is_zarr(station, year):
+        return zarr_values(station, year)
 
     hfile = file_fmt.format(station, year)
-    f = h5py.File(source + hfile, "r")
+
+    out = list()
+    with h5py.File(source + hfile, "r") as f:
+        if f.attrs.get('layout') == 'dense':
+            return dense_values(f, year)
+        for k in list(f.keys()):
+            idx = datetime.strptime(k, 'Y%Y%m%dZ%H')
+            out.append((idx, read_values(f[k])))
+    return out
+
+
+def read_values(node):
+
+    """
+    Sounding of a pytables node written by wyominglib, as a
+    (levels, 11) array with the columns of colnames
+
+    The data columns are stored together in the values_block_0
+    field of the table, which is read in one slice.
+
+    :param node: h5py group of one sounding (e.g. f['Y20010101Z00'])
+    :return: 2-D float array, or None for a 'NO SOUNDING' placeholder
+    """
+
+    table = node['table']
+    if table.shape[0] <= 1:
+        return None
+    return table.fields('values_block_0')[:]
+
+
+def get_df_year(year, station=None):
 
     all_dfs = list()
     df_index = list()
-    for k in list(f.keys()):
-        sound = f[k]['table'].value
-        # print k
-        idx = datetime.strptime(k, 'Y%Y%m%dZ%H')
+    for idx, values in year_values(station, year):
         df_index.append(idx)
-        if sound.size <= 1:
+        if values is None:
             df = np.nan
         else:
-            data = dict(pres=np.array([v[1][0] for v in sound]),
-                        hght=np.array([v[1][1] for v in sound]),
-                        temp=np.array([v[1][2] for v in sound]),
-                        dewp=np.array([v[1][3] for v in sound]),
-                        relh=np.array([v[1][4] for v in sound]),
-                        mixr=np.array([v[1][5] for v in sound]),
-                        drct=np.array([v[1][6] for v in sound]),
-                        sknt=np.array([v[1][7] for v in sound]),
-                        thta=np.array([v[1][8] for v in sound]),
-                        thte=np.array([v[1][9] for v in sound]),
-                        thtv=np.array([v[1][10] for v in sound])
-                        )
-            df = pd.DataFrame(data=data)
+            df = pd.DataFrame(data=values, columns=df_names)
 
         all_dfs.append(df)
 
@@ -64,38 +195,30 @@ def get_df_year(year, station=None):
 
 def get_raw(year, index=None, isel=0, station=None):
 
-    hfile = file_fmt.format(station, year)
-    f = h5py.File(source + hfile, "r")
+    if is_zarr(station, year):
+        idx, values = zarr_values(station, year)[isel]
+        print(idx.strftime('Y%Y%m%dZ%H'))
+    else:
+        hfile = file_fmt.format(station, year)
+        with h5py.File(source + hfile, "r") as f:
+            if f.attrs.get('layout') == 'dense':
+                idx, values = dense_values(f, year)[isel]
+                k = idx.strftime('Y%Y%m%dZ%H')
+            else:
+                k = list(f.keys())[isel]
+                values = read_values(f[k])
+            print(k)
 
-    for k in list(f.keys())[isel:isel+1]:
+    if values is None:
+        data = np.array([np.nan]*48)
+        df = pd.DataFrame(data=data)
+    else:
+        df = pd.DataFrame(data=values, columns=df_names)
 
-        sound = f[k]['table'].value
-        print(k)
-        if sound.size <= 1:
-            data = np.array([np.nan]*48)
-            df = pd.DataFrame(data=data)
-        else:
-            data = dict(pres=np.array([v[1][0] for v in sound]),
-                        hght=np.array([v[1][1] for v in sound]),
-                        temp=np.array([v[1][2] for v in sound]),
-                        dewp=np.array([v[1][3] for v in sound]),
-                        relh=np.array([v[1][4] for v in sound]),
-                        mixr=np.array([v[1][5] for v in sound]),
-                        drct=np.array([v[1][6] for v in sound]),
-                        sknt=np.array([v[1][7] for v in sound]),
-                        thta=np.array([v[1][8] for v in sound]),
-                        thte=np.array([v[1][9] for v in sound]),
-                        thtv=np.array([v[1][10] for v in sound])
-                        )
-
-            if index in ['h','hgt','height']:
-                idx = data.pop('hght')
-                df = pd.DataFrame(data=data,index=idx)
-            elif index in ['p','pres','press']:
-                idx = data.pop('pres')
-                df = pd.DataFrame(data=data,index=idx)
-            else:
-                df = pd.DataFrame(data=data)
+        if index in ['h','hgt','height']:
+            df = df.set_index('hght').rename_axis(None)
+        elif index in ['p','pres','press']:
+            df = df.set_index('pres').rename_axis(None)
 
     return df
 
@@ -157,31 +280,15 @@ def get_wysound_serie(station=None, year=None):
     # Replaced by get_raw
     ###
 
-    hfile = file_fmt.format(station, year)
-    f = h5py.File(source + hfile, "r")
-
-    for k in list(f.keys()):
-
-        sound = f[k]['table'].value
+    for n, (k, values) in enumerate(year_values(station, year)):
 
-        if sound.size <= 1:
+        if values is None:
             array = np.array([np.nan]*48)
         else:
-            # pres = np.array([v[1][0] for v in sound])
-            # hght = np.array([v[1][1] for v in sound])
-            # temp = np.array([v[1][2] for v in sound])
-            # dewp = np.array([v[1][3] for v in sound])
-            # relh = np.array([v[1][4] for v in sound])
-            # mixr = np.array([v[1][5] for v in sound])
-            # drct = np.array([v[1][6] for v in sound])
-            # sknt = np.array([v[1][7] for v in sound])
-            # thta = np.array([v[1][8] for v in sound])
-            thte = np.array([v[1][9] for v in sound])
-            # thtv = np.array([v[1][10] for v in sound])
-            array = thte
+            array = values[:, 9]  # thte
 
         print(k)
-        if k == list(f.keys())[0]:
+        if n == 0:
             bigarray = array
         else:
             print(bigarray.shape, array.shape)
@@ -193,9 +300,7 @@ def get_wysound_serie(station=None, year=None):
 def get_df(sounding):
 
     if sounding.size > 1:
-        array = sounding[0][1]
-        for row in sounding[1:]:
-            array = np.vstack((array,row[1]))
+        array = sounding['values_block_0']
         df = pd.DataFrame(data=array, columns=colnames)
     else:
         print('No sounding available')
@@ -301,8 +406,6 @@ def get_timeseries_freezh(year=None, location=None,
     :return: closest altitude of freezing level
     """
 
-    from datetime import datetime
-
     if year is None:
         years = list(range(2000, 2018))
     else:
@@ -314,26 +417,22 @@ def get_timeseries_freezh(year=None, location=None,
     tmp_thres_degc = 3
 
     for yr in years:
-        fname = "/wyoming_samer_{}_{}.h5"
-        fpath = source + fname.format(location, yr)
-        f = h5py.File(fpath, "r")
         print('Processing year: {}'.format(yr))
-        for k in list(f.keys()):
-            sound = f[k]['table'].value
-            t = np.append(t, datetime.strptime(k,'Y%Y%m%dZ%H'))
+        for k, values in year_values(location, yr):
+            t = np.append(t, k)
             if interp:
-                df = get_df(sound)
-                if df.size == 0:
+                if values is None:
                     x = np.append(x, np.nan)
                     y = np.append(y, np.nan)
                 else:
+                    df = pd.DataFrame(data=values, columns=colnames)
                     freezh = interp_freezh(df, out='value')
                     x = np.append(x, freezh)
                     y = np.append(y, 0.0)
             else:
-                if sound.size > 1:
-                    hght = np.array([v[1][1] for v in sound])
-                    temp = np.array([v[1][2] for v in sound])
+                if values is not None:
+                    hght = values[:, 1]
+                    temp = values[:, 2]
                     idx = np.abs(temp).argmin()
 
                     filter_ok = (temp[idx] > -tmp_thres_degc) and \
@@ -361,17 +460,13 @@ def get_timeseries_freezh(year=None, location=None,
         return df
 
 
-def check_hgt_range(year=None):
-
-    f = h5py.File(source+file_fmt.format(year),
-                  "r")
+def check_hgt_range(year=None, station=None):
 
     min = np.array([])
     max = np.array([])
-    for k in list(f.keys()):
-        sound = f[k]['table'].value
-        if sound.size > 1:
-            hght = np.array([v[1][1] for v in sound])
+    for k, values in year_values(station, year):
+        if values is not None:
+            hght = values[:, 1]
 
             min = np.append(min, hght.min())
             max = np.append(max, hght.max())
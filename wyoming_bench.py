@@ -0,0 +1,311 @@
+"""
+    Benchmarks of the wyoming page parser
+
+    Times the block extraction and the full parse of captured
+    wyoming pages, e.g. the raw pages of a ResponseCache:
+
+    python wyoming_bench.py /home/raul/WY_CACHE
+    python wyoming_bench.py page1.html page2.html
+
+    Without pages, make_frames/iter_frames, parse_data and
+    parse_header are timed on synthetic pages of growing size:
+
+    python wyoming_bench.py
+
+    and the end-to-end download speed is measured against a local
+    fake server (wyoming_server) with:
+
+    python wyoming_bench.py --download --latency 0.1
+
+"""
+
+import sys
+import time
+import argparse
+
+import numpy as np
+import pandas as pd
+
+import wyominglib as wl
+
+column_line = ('   PRES   HGHT   TEMP   DWPT   RELH   MIXR'
+               '   DRCT   SKNT   THTA   THTE   THTV')
+unit_line = ('    hPa     m      C      C      %    g/kg'
+             '    deg   knot     K      K      K ')
+rule_line = '-' * 77
+field_formats = ['{:7.1f}', '{:7.0f}', '{:7.1f}', '{:7.1f}', '{:7.0f}',
+                 '{:7.2f}', '{:7.0f}', '{:7.0f}', '{:7.1f}', '{:7.1f}',
+                 '{:7.1f}']
+# columns that go blank in real soundings (humidity and wind)
+blank_columns = [3, 4, 5, 6, 7, 9, 10]
+header_variants = ['full', 'short', 'showalter']
+
+
+def load_pages(paths):
+    """
+    Read html pages from files, or from every *.html file below
+    the directories in paths
+    """
+    pages = list()
+    for name in wl.page_files(paths):
+        with open(name, 'rb') as f:
+            pages.append(f.read())
+    return pages
+
+
+def synthetic_levels(nlevels, rng, blank_fraction=0.1):
+    """
+    Data lines of a plausible sounding with nlevels levels, from
+    the surface to 10 hPa; a fraction of the humidity and wind
+    fields are left blank, as in real soundings
+    """
+    surface = rng.uniform(990., 1025.)
+    pres = np.geomspace(surface, 10., nlevels)
+    hght = 7400. * np.log(surface / pres) + rng.uniform(0., 300.)
+    temp = np.maximum(25. - 6.5e-3 * hght, -60.) + rng.normal(0, 1, nlevels)
+    dwpt = temp - rng.uniform(0.5, 20., nlevels)
+    relh = np.clip(100. * np.exp(0.06 * (dwpt - temp)), 1., 100.)
+    mixr = 3.8 * np.exp(0.07 * dwpt) * 1000. / pres
+    drct = rng.uniform(0., 360., nlevels)
+    sknt = rng.uniform(0., 80., nlevels)
+    thta = (temp + 273.15) * (1000. / pres) ** 0.286
+    thte = thta + 2.5 * mixr
+    thtv = thta * (1. + 0.61e-3 * mixr)
+    values = np.column_stack([pres, hght, temp, dwpt, relh, mixr, drct,
+                              sknt, thta, thte, thtv])
+    blank = rng.random((nlevels, len(blank_columns))) < blank_fraction
+
+    lines = list()
+    if surface < 1000.:
+        # levels below ground are listed with pressure and height only
+        lines.append('{:7.1f}{:7.0f}'.format(1000., hght[0] - 100.)
+                     .ljust(77))
+    for row, row_blank in zip(values, blank):
+        fields = [fmt.format(value) for fmt, value in zip(field_formats, row)]
+        for column, is_blank in zip(blank_columns, row_blank):
+            if is_blank:
+                fields[column] = ' ' * 7
+        lines.append(''.join(fields))
+    return lines
+
+
+def synthetic_header(thetime, station='85799', variant='full', rng=None):
+    """
+    Station information and indices block of a sounding; variant
+    'short' stops at the station elevation and 'showalter' follows
+    it with the Showalter index only
+    """
+    if rng is None:
+        rng = np.random.default_rng(0)
+    lines = ['Station identifier: SCTE',
+             'Station number: {}'.format(station),
+             'Observation time: {}'.format(thetime.strftime('%y%m%d/%H%M')),
+             'Station latitude: -41.43',
+             'Station longitude: -73.10',
+             'Station elevation: 85.0']
+    if variant == 'showalter':
+        lines.append('Showalter index: {:.2f}'.format(rng.normal(5, 5)))
+    elif variant == 'full':
+        for label in list(wl.index_names)[6:]:
+            lines.append('{}: {:.2f}'.format(label, rng.normal(50, 50)))
+    return '\n'.join(line.rjust(60) for line in lines)
+
+
+def synthetic_sounding(thetime, nlevels=100, station='85799',
+                       blank_fraction=0.1, variant='full', rng=None):
+    """ html of one sounding: <h2> title and its two <pre> blocks """
+    if rng is None:
+        rng = np.random.default_rng(0)
+    title = '{} SCTE Puerto Montt Observations at {}'.format(
+        station, thetime.strftime('%HZ %d %b %Y'))
+    data = [rule_line, column_line, unit_line, rule_line]
+    data += synthetic_levels(nlevels, rng, blank_fraction)
+    header = synthetic_header(thetime, station, variant, rng)
+    return ('<H2>{}</H2>\n<PRE>\n{}\n</PRE>'
+            '<H3>Station information and sounding indices</H3>'
+            '<PRE>\n{}\n</PRE>\n'.format(title, '\n'.join(data), header))
+
+
+def synthetic_page(times, nlevels=100, station='85799',
+                   blank_fraction=0.1, variants=('full',), seed=0):
+    """
+    A wyoming TEXT:LIST page (bytes) with one sounding per time;
+    header variants are cycled through and the level count varies
+    by +-20% around nlevels
+    """
+    rng = np.random.default_rng(seed)
+    body = list()
+    for n, thetime in enumerate(times):
+        levels = max(2, int(nlevels * rng.uniform(0.8, 1.2)))
+        body.append(synthetic_sounding(thetime, levels, station,
+                                       blank_fraction,
+                                       variants[n % len(variants)], rng))
+    return ('<HTML>\n<TITLE>University of Wyoming - Radiosonde Data'
+            '</TITLE>\n<BODY BGCOLOR="white">\n' + ''.join(body) +
+            '<P>Description of the \n<A HREF="/upperair/columns.html">'
+            'sounding columns and indices</A>.\n<P>\n</BODY></HTML>\n'
+            ).encode()
+
+
+def best_time(func, pages, repeat=3):
+    """ best wall time (s) of func applied to every page """
+    times = list()
+    for _ in range(repeat):
+        start = time.perf_counter()
+        for page in pages:
+            func(page)
+        times.append(time.perf_counter() - start)
+    return min(times)
+
+
+def bench_extract(pages, repeat=3):
+    """
+    Compare extract_blocks with BeautifulSoup, for the block
+    extraction alone and for the full iter_frames parse
+
+    Returns a dict of best times in seconds
+    """
+    return dict(
+        extract_fast=best_time(wl.extract_blocks, pages, repeat),
+        extract_soup=best_time(wl.soup_blocks, pages, repeat),
+        parse_fast=best_time(lambda p: list(wl.iter_frames(p)),
+                             pages, repeat),
+        parse_soup=best_time(lambda p: list(wl.iter_frames(p, fast=False)),
+                             pages, repeat))
+
+
+def bench_scales(levels=(25, 100, 400), soundings=(1, 10, 62),
+                 repeat=3):
+    """
+    Time the parser on synthetic pages of every (levels, soundings)
+    combination, mixing blank fields and header variants
+
+    Returns a DataFrame with the page size (kB), the time of a
+    full iter_frames parse of the page (ms) and the time per
+    sounding of parse_data and parse_header (ms)
+    """
+    rows = list()
+    for nlevels in levels:
+        for count in soundings:
+            times = pd.date_range('2001-01-01', periods=count, freq='12h')
+            page = synthetic_page(times, nlevels,
+                                  variants=header_variants)
+            titles, pres = wl.extract_blocks(page)
+            data, headers = pres[0::2], pres[1::2]
+            rows.append(dict(
+                levels=nlevels, soundings=count,
+                page_kb=len(page) / 1e3,
+                iter_frames_ms=1e3 * best_time(
+                    lambda p: list(wl.iter_frames(p)), [page], repeat),
+                make_frames_ms=1e3 * best_time(wl.make_frames, [page],
+                                               repeat),
+                parse_data_ms=1e3 * best_time(wl.parse_data, data,
+                                              repeat) / count,
+                parse_header_ms=1e3 * best_time(wl.parse_header, headers,
+                                                repeat) / count))
+    return pd.DataFrame(rows)
+
+
+download_configs = [dict(),
+                    dict(workers=8),
+                    dict(batch='month'),
+                    dict(batch='month', stream=True),
+                    dict(batch='month', workers=4)]
+
+
+def bench_download(configs=download_configs, dates=('2001-01-01',
+                                                   '2001-03-31 12:00'),
+                   **server_kwargs):
+    """
+    End-to-end throughput of download_wyoming against a local
+    wyoming_server.FakeWyomingServer
+
+    Parameters
+    ----------
+
+    configs : list
+              download_wyoming keyword sets to compare
+
+    dates : tuple
+            first and last sounding time downloaded
+
+    server_kwargs :
+            FakeWyomingServer settings (latency, rate, error_rate, ...)
+
+    Returns a DataFrame with the soundings per second, requests
+    sent and server counters of every config
+    """
+    import io
+    import tempfile
+    import contextlib
+    from wyoming_server import FakeWyomingServer
+
+    rows = list()
+    saved = wl.base_url
+    with FakeWyomingServer(**server_kwargs) as server:
+        wl.base_url = server.url
+        try:
+            for config in configs:
+                before = dict(server.counts)
+                workers = config.get('workers', 1)
+                session = wl.WyomingSession(maxsize=max(4, workers))
+                with tempfile.TemporaryDirectory() as tmp:
+                    start = time.perf_counter()
+                    with contextlib.redirect_stdout(io.StringIO()):
+                        wl.download_wyoming(region='samer',
+                                            station=dict(name='bench',
+                                                         number='85799'),
+                                            out_directory=tmp,
+                                            dates=list(dates),
+                                            session=session, **config)
+                    elapsed = time.perf_counter() - start
+                session.close()
+                count = len(pd.date_range(dates[0], dates[1], freq='12h'))
+                row = dict(config=str(config), seconds=elapsed,
+                           soundings_per_s=count / elapsed)
+                for key in ['requests', 'throttled', 'errors']:
+                    row[key] = server.counts[key] - before.get(key, 0)
+                rows.append(row)
+        finally:
+            wl.base_url = saved
+    return pd.DataFrame(rows)
+
+
+def report(results, pages):
+    nbytes = sum(len(p) for p in pages)
+    print('{} pages, {:.1f} MB'.format(len(pages), nbytes / 1e6))
+    for key, value in results.items():
+        print('{:>14s}: {:8.4f} s'.format(key, value))
+    print('extract speedup: {:.1f}x'.format(results['extract_soup'] /
+                                             results['extract_fast']))
+    print('  parse speedup: {:.1f}x'.format(results['parse_soup'] /
+                                             results['parse_fast']))
+
+
+if __name__ == '__main__':
+
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[1])
+    parser.add_argument('paths', nargs='*',
+                        help='captured pages or directories of pages')
+    parser.add_argument('--repeat', type=int, default=3)
+    parser.add_argument('--download', action='store_true',
+                        help='time download_wyoming against a local '
+                             'fake server instead of the parser')
+    parser.add_argument('--latency', type=float, default=0.05,
+                        help='fake server latency (s)')
+    args = parser.parse_args()
+
+    if args.download:
+        with pd.option_context('display.width', 120,
+                               'display.precision', 3):
+            print(bench_download(latency=args.latency).to_string(index=False))
+    elif args.paths:
+        pages = load_pages(args.paths)
+        if not pages:
+            print('no pages found in {}'.format(args.paths))
+            sys.exit(1)
+        report(bench_extract(pages, args.repeat), pages)
+    else:
+        with pd.option_context('display.width', 120,
+                               'display.precision', 3):
+            print(bench_scales(repeat=args.repeat).to_string(index=False))
@@ -0,0 +1,277 @@
+"""
+    On-disk cache of raw wyoming sounding pages
+
+    Pages are stored under the sha1 of their request
+    (region, station, year, month, FROM, TO), so the same
+    window always maps to the same file whatever the host
+    or parameter order of the url.
+
+    Example
+
+    import wyominglib as wl
+    from wyoming_cache import ResponseCache
+
+    cache = ResponseCache('/home/raul/WY_CACHE', max_bytes=5e9)
+    session = wl.WyomingSession(cache=cache)
+    wl.download_wyoming(region='samer',
+                        station=dict(name='ptomnt', number='85799'),
+                        out_directory='/home/raul',
+                        year=2001,
+                        session=session)
+
+    Known gaps ('NO SOUNDING') are remembered with MissingCache:
+
+    missing = MissingCache('/home/raul/WY_CACHE')
+    wl.download_wyoming(..., missing=missing)
+
+"""
+
+import os
+import json
+import time
+import hashlib
+import threading
+import calendar
+from datetime import datetime
+from urllib.parse import urlparse, parse_qs
+
+key_fields = ['region', 'STNM', 'YEAR', 'MONTH', 'FROM', 'TO']
+
+
+def request_key(url):
+    """
+    Return the (region, station, year, month, from, to) tuple
+    identifying the sounding window requested by url
+    """
+    query = parse_qs(urlparse(url).query)
+    return tuple(query.get(field, [''])[0] for field in key_fields)
+
+
+def window_end(key):
+    """
+    Return the last sounding time (datetime) of a request key,
+    or None if the key does not hold a complete window
+    """
+    _, _, year, month, _, stop = key
+    try:
+        year = int(year)
+        month = int(month)
+        day = min(int(stop[:2]), calendar.monthrange(year, month)[1])
+        return datetime(year, month, day, int(stop[2:4] or 0))
+    except ValueError:
+        return None
+
+
+class ResponseCache:
+    """
+    Content-addressed cache of raw responses with LRU eviction
+
+    Parameters
+    ----------
+
+    directory : str
+                cache root; created if missing
+
+    max_bytes : float
+                total size kept on disk; least recently used
+                pages are deleted beyond it
+
+    ttl : float
+          lifetime in seconds of pages whose window ends less than
+          ``recent_days`` ago, since those may still be revised
+
+    recent_days : float
+                  age (days) after which a window is considered final
+                  and its page never expires
+    """
+
+    def __init__(self, directory, max_bytes=2e9, ttl=86400.,
+                 recent_days=30.):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self.recent_days = recent_days
+        self.lock = threading.Lock()
+        os.makedirs(directory, exist_ok=True)
+        self.size = sum(os.path.getsize(path) for path in self._files())
+
+    def _files(self):
+        for root, _, names in os.walk(self.directory):
+            for name in names:
+                if name.endswith('.html'):
+                    yield os.path.join(root, name)
+
+    def path(self, url):
+        """ file holding the page of url """
+        return self.key_path(request_key(url))
+
+    def key_path(self, key):
+        """ file holding the page of a request_key tuple """
+        digest = hashlib.sha1('/'.join(key).encode()).hexdigest()
+        return os.path.join(self.directory, digest[:2], digest + '.html')
+
+    def is_final(self, url):
+        """ True if the window of url is old enough to never change """
+        end = window_end(request_key(url))
+        if end is None:
+            return False
+        age = time.time() - calendar.timegm(end.timetuple())
+        return age > self.recent_days * 86400.
+
+    def get(self, url):
+        """
+        Return the cached page of url as bytes, or None on a miss
+        or when a page of a recent window is older than ttl
+        """
+        path = self.path(url)
+        try:
+            mtime = os.path.getmtime(path)
+            if not self.is_final(url) and time.time() - mtime > self.ttl:
+                return None
+            with open(path, 'rb') as f:
+                data = f.read()
+        except OSError:
+            return None
+        # mark as recently used, keeping mtime as the write time
+        os.utime(path, (time.time(), mtime))
+        return data
+
+    def put(self, url, data):
+        """ store the page of url and evict old pages if needed """
+        path = self.path(url)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp = '{}.{}.tmp'.format(path, threading.get_ident())
+        with open(tmp, 'wb') as f:
+            f.write(data)
+        with self.lock:
+            try:
+                self.size -= os.path.getsize(path)
+            except OSError:
+                pass
+            os.replace(tmp, path)
+            self.size += len(data)
+            if self.size > self.max_bytes:
+                self.evict()
+
+    def evict(self):
+        """ delete least recently used pages until under max_bytes """
+        files = sorted((os.stat(path).st_atime, path)
+                       for path in self._files())
+        for _, path in files:
+            if self.size <= self.max_bytes:
+                break
+            try:
+                self.size -= os.path.getsize(path)
+                os.remove(path)
+            except OSError:
+                pass
+
+    def clear(self):
+        for path in list(self._files()):
+            os.remove(path)
+        self.size = 0
+
+
+class MissingCache:
+    """
+    Persistent per-station record of sounding times the server
+    had no data for ('NO SOUNDING'), so they are not asked again
+
+    Each station is kept in a small json file mapping launch time
+    to the unix time it was last found missing. A known gap is
+    re-checked once it is older than ``recent_recheck_days`` if the
+    launch is recent (within ``recent_days``), or older than
+    ``recheck_days`` otherwise.
+
+    Parameters
+    ----------
+
+    directory : str
+                where the per-station json files live
+
+    recheck_days : float or None
+                   re-check interval of old gaps; None never
+                   re-checks them
+
+    recent_days : float
+                  launches younger than this may still be filled
+                  in by the server
+
+    recent_recheck_days : float
+                          re-check interval of recent gaps
+    """
+
+    def __init__(self, directory, recheck_days=365., recent_days=30.,
+                 recent_recheck_days=1.):
+        self.directory = directory
+        self.recheck_days = recheck_days
+        self.recent_days = recent_days
+        self.recent_recheck_days = recent_recheck_days
+        self.lock = threading.Lock()
+        self.stations = dict()
+        self.dirty = set()
+        os.makedirs(directory, exist_ok=True)
+
+    def path(self, region, station):
+        return os.path.join(self.directory,
+                            'missing_{}_{}.json'.format(region, station))
+
+    def _load(self, region, station):
+        key = (region, station)
+        if key not in self.stations:
+            try:
+                with open(self.path(region, station)) as f:
+                    self.stations[key] = json.load(f)
+            except (OSError, ValueError):
+                self.stations[key] = dict()
+        return self.stations[key]
+
+    def _expired(self, launch, checked, now):
+        age = now - calendar.timegm(launch.timetuple())
+        if age < self.recent_days * 86400.:
+            interval = self.recent_recheck_days
+        else:
+            interval = self.recheck_days
+        if interval is None:
+            return False
+        return now - checked > interval * 86400.
+
+    def skip(self, region, station, dates):
+        """
+        Return the subset of dates known to be missing and not
+        yet due for a re-check
+        """
+        now = time.time()
+        with self.lock:
+            known = self._load(region, station)
+            out = set()
+            for date in dates:
+                checked = known.get(date.strftime('%Y%m%d%H'))
+                if checked is not None and \
+                        not self._expired(date, checked, now):
+                    out.add(date)
+        return out
+
+    def update(self, region, station, date, found):
+        """ record whether the sounding of date was found """
+        stamp = date.strftime('%Y%m%d%H')
+        with self.lock:
+            known = self._load(region, station)
+            if found:
+                if known.pop(stamp, None) is not None:
+                    self.dirty.add((region, station))
+            else:
+                known[stamp] = time.time()
+                self.dirty.add((region, station))
+
+    def flush(self):
+        """ write the stations changed since the last flush """
+        with self.lock:
+            for region, station in self.dirty:
+                path = self.path(region, station)
+                tmp = path + '.tmp'
+                with open(tmp, 'w') as f:
+                    json.dump(self.stations[(region, station)], f,
+                              sort_keys=True)
+                os.replace(tmp, path)
+            self.dirty = set()
@@ -1,32 +1,241 @@
+"""
+    Station x time inventory of wyoming sounding archives
+
+    Availability is read from the archive catalogs (see
+    wyominglib.read_catalog), a few kilobytes per archive. Archives
+    written before catalogs existed are scanned once on a process
+    pool and their catalog is kept, next to the archive or in a
+    cache directory, so later inventories only scan new files.
+
+    Example
+
+    import wyoming_inventory as wi
+
+    avail = wi.inventory('/home/raul/WY_SOUNDINGS')
+    avail.sel(station='ptomnt').resample(time='MS').mean()
+    wi.plot_inventory(avail)
+
+    or from a shell:
+
+    python wyoming_inventory.py '/home/raul/WY_SOUNDINGS/*_ptomnt_*.h5'
+
+"""
+
+import os
+import re
+import hashlib
 from glob import glob
 
-import h5py
-import matplotlib.pyplot as plt
 import numpy as np
+import pandas as pd
+import xarray as xr
+
+import wyominglib as wl
+
+# wyoming_<region>_<station>[_<dates>].h5 or .zarr; dates are a year,
+# a launch time or a range of launch times (see wl.station_dates)
+archive_re = re.compile(r'wyoming_(?P<region>[^_]+)_(?P<station>.+?)'
+                        r'(?:_(?P<dates>\d{4}|\d{10}|\d{10}-\d{10}))?'
+                        r'\.(?:h5|zarr)$')
+
+
+def archive_files(paths):
+    """
+    Archives in paths: hdf files and zarr stores are kept as given,
+    glob patterns expanded and directories searched for archives
+    (sidecar files, e.g. *_indices.h5, are left out) and for the
+    station partitions of parquet datasets
+    """
+    if isinstance(paths, str):
+        paths = [paths]
+    found = list()
+    for path in paths:
+        if os.path.isdir(path) and not path.endswith(('.zarr', '.parquet')):
+            found.extend(glob(os.path.join(path, 'wyoming_*.h5')))
+            found.extend(glob(os.path.join(path, 'wyoming_*.zarr')))
+            found.extend(glob(os.path.join(path, 'wyoming_*.parquet',
+                                           'station=*')))
+        elif path.endswith('.parquet'):
+            found.extend(glob(os.path.join(path, 'station=*')))
+        else:
+            found.extend(glob(path))
+    found = [path.rstrip('/') for path in found
+             if not path.endswith(('_indices.h5', '_catalog.h5'))]
+    return sorted(set(found))
+
+
+def archive_station(path):
+    """ station name of an archive, from its file name """
+    name = os.path.basename(path.rstrip('/'))
+    if name.startswith('station='):
+        return name[len('station='):]
+    match = archive_re.match(name)
+    if match is None:
+        return name
+    return match.group('station')
+
+
+def cache_path(path, cache_dir):
+    """ catalog of a legacy archive kept in cache_dir """
+    digest = hashlib.sha1(os.path.abspath(path).encode()).hexdigest()
+    return os.path.join(cache_dir, digest + '.h5')
+
+
+def cached_catalog(path, cache_dir=None):
+    """
+    Catalog of an archive, or None if it has to be scanned: archives
+    written by wyominglib carry theirs, and legacy ones may have one
+    in cache_dir that is newer than the archive
+    """
+    if path.endswith('.zarr') or os.path.exists(wl.catalog_name(path)):
+        return wl.read_catalog(path)
+    if cache_dir is not None:
+        cached = cache_path(path, cache_dir)
+        if os.path.exists(cached) and \
+                os.path.getmtime(cached) >= os.path.getmtime(path):
+            return pd.read_hdf(cached, 'catalog')
+    return None
+
+
+def store_catalog(path, catalog, cache_dir=None):
+    """ keep the scanned catalog of a legacy archive """
+    if cache_dir is None:
+        wl.write_catalog(path, catalog)
+        return
+    os.makedirs(cache_dir, exist_ok=True)
+    catalog.to_hdf(cache_path(path, cache_dir), key='catalog', mode='w',
+                   format='table', complevel=9, complib='blosc:zstd')
+
 
-files = glob('/home/raul/WY_SOUNDINGS/*_ptomnt_*.h5')
-files.sort()
-
-matrix = np.empty((366 * 2, 12))
-for c, file in enumerate(files):
-    print(file)
-    f = h5py.File(file, 'r')
-    for r, k in enumerate(f.keys()):
-        shape = f[k + '/table'].value[0][1].shape[0]
-        if shape == 1:
-            matrix[r][c] = 0
+def catalogs(paths, cache_dir=None, workers=None):
+    """
+    Catalogs of the archives in paths (see archive_files)
+
+    Archives without catalog are scanned with wl.scan_catalog on a
+    pool of ``workers`` processes (default: cpu count) and their
+    catalogs stored (see store_catalog).
+
+    Returns a dict archive -> catalog DataFrame
+    """
+    from concurrent.futures import ProcessPoolExecutor
+
+    out = dict()
+    legacy = list()
+    for path in archive_files(paths):
+        catalog = cached_catalog(path, cache_dir)
+        if catalog is None:
+            legacy.append(path)
         else:
-            matrix[r][c] = 1
+            out[path] = catalog
+
+    if legacy:
+        print('scanning {} archives without catalog'.format(len(legacy)))
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            for path, catalog in zip(legacy,
+                                     pool.map(wl.scan_catalog, legacy)):
+                store_catalog(path, catalog, cache_dir)
+                out[path] = catalog
+    return out
+
+
+def inventory(paths, cache_dir=None, workers=None, freq='12h',
+              start=None, stop=None):
+    """
+    Station x time availability of the soundings in paths
+
+    Parameters
+    ----------
+
+    paths : str or list
+            archives, glob patterns or directories (see archive_files)
+
+    cache_dir : str, optional
+                where the catalogs of legacy archives are kept;
+                by default next to the archives
+
+    workers : int, optional
+              processes scanning legacy archives
+
+    freq : str
+           launch interval of the time axis
+
+    start, stop : optional
+                  time range; defaults to the span of the archives
+
+    Returns
+    -------
+
+    available : xr.DataArray
+                bool (station, time); stations are named after the
+                archive files (see archive_station)
+    """
+    stations = dict()
+    for path, catalog in catalogs(paths, cache_dir, workers).items():
+        found = pd.Series(~catalog['empty'].values, index=catalog.index)
+        stations.setdefault(archive_station(path), list()).append(found)
+
+    series = dict()
+    for station, found in stations.items():
+        found = pd.concat(found)
+        series[station] = found.groupby(level=0).max()
+    frame = pd.DataFrame(series)
+
+    if start is None:
+        start = frame.index.min() if len(frame) else None
+    if stop is None:
+        stop = frame.index.max() if len(frame) else None
+    if start is None or stop is None:
+        times = pd.DatetimeIndex([], name='time')
+    else:
+        times = pd.date_range(pd.Timestamp(start).floor(freq),
+                              pd.Timestamp(stop), freq=freq, name='time')
+    frame = frame.reindex(times).fillna(False).astype(bool)
+
+    return xr.DataArray(frame.T.values,
+                        coords=dict(station=list(frame.columns),
+                                    time=times),
+                        dims=('station', 'time'), name='available')
+
+
+def plot_inventory(available, ax=None):
+    """
+    Plot an inventory: one row per station, dark where soundings
+    exist, with yearly ticks
+    """
+    import matplotlib.pyplot as plt
+
+    nstations = available.sizes['station']
+    if ax is None:
+        _, ax = plt.subplots(figsize=(12, 1 + 0.4 * nstations))
+    times = available['time'].to_index()
+    ax.pcolormesh(np.arange(len(times) + 1),
+                  np.arange(nstations + 1),
+                  available.values.astype(np.int8),
+                  vmin=0, vmax=1, cmap='Greys')
+    years = np.flatnonzero((times.month == 1) & (times.day == 1) &
+                           (times.hour == 0))
+    ax.xaxis.set(ticks=years, ticklabels=[str(times[n].year)
+                                          for n in years])
+    ax.yaxis.set(ticks=np.arange(nstations) + 0.5,
+                 ticklabels=list(available['station'].values))
+    ax.grid(True, axis='x')
+    return ax
+
+
+if __name__ == '__main__':
 
-fig, ax = plt.subplots()
-ax.pcolormesh(matrix, vmin=0, vmax=1)
+    import argparse
+    import matplotlib.pyplot as plt
 
-# Set the major ticks at the centers and minor 
-# tick at the edges
-labels = [str(l).zfill(2) for l in range(0, 12)]
-locs = np.arange(len(labels))
-ax.xaxis.set(ticks=locs + 0.5, ticklabels=labels)
-ax.xaxis.set_ticks(locs, minor=True)
-ax.grid(True, which='minor')
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[1])
+    parser.add_argument('paths', nargs='+',
+                        help='archives, glob patterns or directories')
+    parser.add_argument('--cache-dir', default=None)
+    parser.add_argument('--workers', type=int, default=None)
+    args = parser.parse_args()
 
-plt.show(block=False)
+    available = inventory(args.paths, cache_dir=args.cache_dir,
+                          workers=args.workers)
+    print(available.mean('time').to_pandas().to_string())
+    plot_inventory(available)
+    plt.show()
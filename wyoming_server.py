@@ -0,0 +1,226 @@
+"""
+    Local stand-in for the wyoming sounding CGI
+
+    Answers the same sounding?region=...&TYPE=TEXT:LIST&YEAR=...
+    &MONTH=...&FROM=...&TO=...&STNM=... queries from recorded pages
+    (a ResponseCache directory) or from synthetic pages, with
+    configurable latency, throttling and error injection, so that
+    the download path can be tuned offline.
+
+    Example
+
+    import wyominglib as wl
+    from wyoming_server import FakeWyomingServer
+
+    with FakeWyomingServer(latency=0.2, rate=10.) as server:
+        wl.base_url = server.url
+        wl.download_wyoming(region='samer',
+                            station=dict(name='ptomnt', number='85799'),
+                            out_directory='/tmp',
+                            year=2001)
+
+    or from a shell: python wyoming_server.py --port 8000 --latency 0.2
+
+"""
+
+import time
+import zlib
+import random
+import threading
+import collections
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+
+import numpy as np
+import pandas as pd
+
+from wyoming_cache import ResponseCache, request_key
+from wyoming_bench import synthetic_page
+
+missing_page = ("<HTML>\n<TITLE>University of Wyoming - Radiosonde Data"
+                "</TITLE>\n<BODY BGCOLOR=\"white\">\n"
+                "<H2>Can't get {station} Observations at {when}.</H2>\n"
+                "</BODY></HTML>\n")
+
+
+def window_times(key):
+    """ 00Z and 12Z launch times inside the window of a request key """
+    _, _, year, month, start, stop = key
+    first = pd.Timestamp('{}-{}-{} {}:00'.format(year, month,
+                                                 start[:2], start[2:4]))
+    last = pd.Timestamp('{}-{}-{} {}:00'.format(year, month,
+                                                stop[:2], stop[2:4]))
+    first = first.ceil('12h')
+    if last < first:
+        return pd.DatetimeIndex([])
+    return pd.date_range(first, last, freq='12h')
+
+
+class FakeWyomingServer:
+    """
+    Threaded HTTP server imitating weather.uwyo.edu/cgi-bin/sounding
+
+    Parameters
+    ----------
+
+    pages : str, optional
+            directory of a wyoming_cache.ResponseCache; recorded pages
+            are served for the requests they answer, and the other
+            requests get synthetic pages
+
+    port : int
+           0 picks a free port
+
+    latency : float
+              seconds added to every answer
+
+    jitter : float
+             uniform random extra latency (seconds)
+
+    rate : float, optional
+           requests per second accepted; beyond it the server
+           answers 503 (throttled)
+
+    error_rate : float
+                 fraction of requests answered with a 500 error
+
+    missing_rate : float
+                   fraction of launches without sounding ('NO SOUNDING');
+                   fixed per station and time, so repeated requests agree
+
+    nlevels : int
+              levels of the synthetic soundings
+    """
+
+    def __init__(self, pages=None, port=0, latency=0., jitter=0.,
+                 rate=None, error_rate=0., missing_rate=0., nlevels=100):
+        self.cache = None if pages is None else ResponseCache(pages)
+        self.latency = latency
+        self.jitter = jitter
+        self.rate = rate
+        self.error_rate = error_rate
+        self.missing_rate = missing_rate
+        self.nlevels = nlevels
+        self.counts = collections.Counter()
+        self.lock = threading.Lock()
+        self.recent = collections.deque()
+        self.httpd = ThreadingHTTPServer(('127.0.0.1', port),
+                                         self._handler())
+        self.httpd.daemon_threads = True
+        self.thread = None
+
+    @property
+    def url(self):
+        host, port = self.httpd.server_address[:2]
+        return 'http://{}:{}/cgi-bin/sounding'.format(host, port)
+
+    def _handler(self):
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+
+            def do_GET(self):
+                status, body = server.answer(self.path)
+                self.send_response(status)
+                self.send_header('Content-Type', 'text/html')
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, *args):
+                pass
+
+        return Handler
+
+    def throttled(self):
+        if self.rate is None:
+            return False
+        now = time.monotonic()
+        with self.lock:
+            while self.recent and now - self.recent[0] > 1.:
+                self.recent.popleft()
+            if len(self.recent) >= self.rate:
+                return True
+            self.recent.append(now)
+        return False
+
+    def is_missing(self, station, thetime):
+        if self.missing_rate <= 0.:
+            return False
+        seed = zlib.crc32('{}{}'.format(station, thetime).encode())
+        return random.Random(seed).random() < self.missing_rate
+
+    def page(self, key):
+        """ body answering the request key """
+        if self.cache is not None:
+            try:
+                with open(self.cache.key_path(key), 'rb') as f:
+                    return f.read()
+            except OSError:
+                pass
+        station = key[1]
+        times = [t for t in window_times(key)
+                 if not self.is_missing(station, t)]
+        if not times:
+            return missing_page.format(station=station,
+                                       when=' '.join(key[2:])).encode()
+        seed = zlib.crc32('/'.join(key).encode())
+        return synthetic_page(times, self.nlevels, station=station,
+                              seed=seed)
+
+    def answer(self, path):
+        """ (status, body) for the request path """
+        with self.lock:
+            self.counts['requests'] += 1
+        delay = self.latency + self.jitter * np.random.random()
+        if delay > 0.:
+            time.sleep(delay)
+        if self.throttled():
+            with self.lock:
+                self.counts['throttled'] += 1
+            return 503, b'<HTML>Server busy, please try again later</HTML>'
+        if self.error_rate > 0. and np.random.random() < self.error_rate:
+            with self.lock:
+                self.counts['errors'] += 1
+            return 500, b'<HTML>Internal Server Error</HTML>'
+        return 200, self.page(request_key(path))
+
+    def start(self):
+        self.thread = threading.Thread(target=self.httpd.serve_forever,
+                                       daemon=True)
+        self.thread.start()
+        return self
+
+    def stop(self):
+        self.httpd.shutdown()
+        self.httpd.server_close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.stop()
+
+
+if __name__ == '__main__':
+
+    import argparse
+
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[1])
+    parser.add_argument('--port', type=int, default=8000)
+    parser.add_argument('--pages', default=None)
+    parser.add_argument('--latency', type=float, default=0.)
+    parser.add_argument('--jitter', type=float, default=0.)
+    parser.add_argument('--rate', type=float, default=None)
+    parser.add_argument('--error-rate', type=float, default=0.)
+    parser.add_argument('--missing-rate', type=float, default=0.)
+    args = parser.parse_args()
+
+    server = FakeWyomingServer(pages=args.pages, port=args.port,
+                               latency=args.latency, jitter=args.jitter,
+                               rate=args.rate, error_rate=args.error_rate,
+                               missing_rate=args.missing_rate)
+    print('serving on {}'.format(server.url))
+    try:
+        server.httpd.serve_forever()
+    except KeyboardInterrupt:
+        server.httpd.server_close()
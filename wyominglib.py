@@ -35,9 +35,16 @@
 
 """
 
+import os
 import re
 import sys
+import time
+import itertools
+import queue
+import threading
+import collections
 import urllib3
+from glob import glob
 import xarray as xr
 import h5py
 import numpy as np
@@ -60,12 +67,14 @@ from thermlib import find_esat
 # Here's a regular expression that does that:
 
 
-re_text = """
+# (raw string, so that \n reaches the regex instead of being a
+# literal newline that VERBOSE drops)
+re_text = r"""
      .*Station\snumber\:\s(.+?)\n
      \s+Observation\stime\:\s(.+?)\n
      \s+Station\slatitude\:\s(.+?)\n
      \s+Station\slongitude\:\s(.+?)\n
-     \s+Station\selevation\:\s(.+?)\n
+     \s+Station\selevation\:\s(.+?)(?:\n|$)
      .*
         """
 
@@ -76,6 +85,379 @@ re_text = """
 #
 header_re = re.compile(re_text, re.DOTALL | re.VERBOSE)
 
+class ParseError(ValueError):
+    """
+    A sounding that does not have the expected wyoming layout
+
+    Attributes
+    ----------
+
+    reason : str
+             what went wrong
+
+    text : str
+           raw text of the offending block
+    """
+
+    def __init__(self, reason, text=''):
+        super().__init__(reason)
+        self.reason = reason
+        self.text = text
+
+
+class ErrorReport:
+    """
+    Collects the soundings that failed to parse, so that a batch
+    run carries on and the failures can be fetched again later
+
+    Pass one to make_frames/iter_frames (or the download functions)
+    with ``errors=``.
+    """
+
+    columns = ['time', 'header', 'reason', 'text']
+
+    def __init__(self):
+        self.records = list()
+
+    def add(self, thetime, header, reason, text):
+        self.records.append(dict(time=thetime, header=header,
+                                 reason=reason, text=text))
+
+    def __len__(self):
+        return len(self.records)
+
+    def to_frame(self):
+        """ failures as a DataFrame with the class columns """
+        return pd.DataFrame(self.records, columns=self.columns)
+
+    def save(self, filename):
+        """ write the failures, with their raw text, to a csv file """
+        self.to_frame().to_csv(filename, index=False)
+
+
+# The same block goes on with the sounding indices computed by the
+# server. They are stored under the short names of the wyoming
+# documentation (weather.uwyo.edu/upperair/columns.html); lines not
+# listed here get a name made from their label.
+index_names = {
+    'Station identifier': 'stid',
+    'Station number': 'stnm',
+    'Observation time': 'time',
+    'Station latitude': 'slat',
+    'Station longitude': 'slon',
+    'Station elevation': 'selv',
+    'Showalter index': 'show',
+    'Lifted index': 'lift',
+    'LIFT computed using virtual temperature': 'lftv',
+    'SWEAT index': 'swet',
+    'K index': 'kinx',
+    'Cross totals index': 'ctot',
+    'Vertical totals index': 'vtot',
+    'Totals totals index': 'tott',
+    'Convective Available Potential Energy': 'cape',
+    'CAPE using virtual temperature': 'capv',
+    'Convective Inhibition': 'cins',
+    'CINS using virtual temperature': 'cinv',
+    'Equilibrum Level': 'eqlv',
+    'Equilibrum Level using virtual temperature': 'eqtv',
+    'Level of Free Convection': 'lfct',
+    'LFCT using virtual temperature': 'lfcv',
+    'Bulk Richardson Number': 'brch',
+    'Bulk Richardson Number using CAPV': 'brcv',
+    'Temp [K] of the Lifted Condensation Level': 'lclt',
+    'Pres [hPa] of the Lifted Condensation Level': 'lclp',
+    'Equivalent potential temp [K] of the LCL': 'lcle',
+    'Mean mixed layer potential temperature': 'mlth',
+    'Mean mixed layer mixing ratio': 'mlmr',
+    '1000 hPa to 500 hPa thickness': 'thtk',
+    'Precipitable water [mm] for entire sounding': 'pwat',
+}
+text_indices = ['stid', 'stnm']
+
+
+def parse_indices(header_text):
+    """
+    Read every line of the "Station information and sounding
+    indices" block
+
+    Parameters
+    ----------
+
+    header_text : str
+                  string containing wyoming header read with make_frames
+
+    Returns
+    -------
+
+    indices : dict
+              short index name (see index_names) -> value; station
+              identifier and number are str, the observation time a
+              pd.Timestamp and every other index a float (NaN if
+              it cannot be read)
+    """
+    indices = dict()
+    for line in header_text.strip().split('\n'):
+        label, sep, value = line.partition(':')
+        if not sep:
+            continue
+        label = label.strip()
+        value = value.strip()
+        name = index_names.get(label)
+        if name is None:
+            name = re.sub(r'[^0-9a-z]+', '_', label.lower()).strip('_')
+        if name in text_indices:
+            indices[name] = value
+        elif name == 'time':
+            indices[name] = pd.to_datetime(value, format='%y%m%d/%H%M',
+                                           errors='coerce')
+        else:
+            try:
+                indices[name] = float(value)
+            except ValueError:
+                indices[name] = np.nan
+    return indices
+
+
+def indices_frame(rows):
+    """
+    Turn (time, indices) pairs into a typed table with one row per
+    sounding, indexed by launch time; numeric indices are float64
+    """
+    times = [thetime for thetime, _ in rows]
+    frame = pd.DataFrame([indices for _, indices in rows],
+                         index=pd.DatetimeIndex(times, name='launch'))
+    for name in frame.columns:
+        if name in text_indices:
+            frame[name] = frame[name].astype(str)
+        elif name != 'time':
+            frame[name] = frame[name].astype(np.float64)
+    return frame
+
+
+def indices_name(out_name):
+    """
+    file holding the sounding indices of an archive: next to an
+    hdf file, or inside a parquet station partition (see
+    catalog_name); zarr stores hold their own (see read_indices)
+    """
+    if os.path.basename(out_name).startswith('station='):
+        return os.path.join(out_name, '_indices.h5')
+    return os.path.splitext(out_name)[0] + '_indices.h5'
+
+
+def write_indices(out_name, rows, mode='w'):
+    """
+    Store the sounding indices of an archive in indices_name(out_name)
+
+    Parameters
+    ----------
+
+    out_name : str
+               hdf archive the soundings were written to
+
+    rows : list
+           (time, indices) pairs, indices from parse_indices; the
+           last pair of a repeated time is kept
+
+    mode : str
+           'w' replaces the table; 'a' merges rows into an existing
+           table, new rows winning on equal times
+    """
+    if len(rows) == 0 and mode == 'a':
+        return
+    frame = indices_frame(rows)
+    # a time can come twice, e.g. from a single-date and a month page
+    frame = frame[~frame.index.duplicated(keep='last')]
+    filename = indices_name(out_name)
+    if mode == 'a' and os.path.exists(filename):
+        old = pd.read_hdf(filename, 'indices')
+        old = old[~old.index.isin(frame.index)]
+        frame = pd.concat([old, frame]).sort_index()
+    frame.to_hdf(filename, key='indices', mode='w', format='table',
+                 data_columns=True)
+
+
+def read_indices(out_name):
+    """
+    Read the sounding indices table of an archive, or of the
+    indices file itself; where=-style queries can be run on it
+    with pd.read_hdf(indices_name(out_name), 'indices', where=...)
+
+    The indices of a zarr store are read from the store (see
+    read_zarr_indices).
+    """
+    if out_name.rstrip('/').endswith('.zarr'):
+        return read_zarr_indices(out_name)
+    if not out_name.endswith('_indices.h5'):
+        out_name = indices_name(out_name)
+    return pd.read_hdf(out_name, 'indices')
+
+
+def catalog_name(out_name):
+    """
+    file listing the soundings of an archive (see write_catalog):
+    next to an hdf file, or inside a parquet station partition
+    (where the leading underscore hides it from parquet readers)
+    """
+    if os.path.basename(out_name).startswith('station='):
+        return os.path.join(out_name, '_catalog.h5')
+    return os.path.splitext(out_name)[0] + '_catalog.h5'
+
+
+def height_range(hght):
+    """ (min, max) of the finite heights, NaN if there are none """
+    hght = hght[np.isfinite(hght)]
+    if len(hght) == 0:
+        return np.nan, np.nan
+    return hght.min(), hght.max()
+
+
+def catalog_frame(entries, station=''):
+    """
+    Table of the soundings of an archive, one row per launch time
+
+    Parameters
+    ----------
+
+    entries : list
+              (time, dataframe, node, row) tuples; dataframe is None
+              for a time without sounding, node the pytables key
+              (table layout) or parquet partition ('' otherwise)
+              and row the time row in a dense or zarr archive (-1
+              otherwise)
+
+    station : str
+              station number of the archive
+
+    Returns
+    -------
+
+    catalog : pd.DataFrame
+              indexed by launch time, with the columns station,
+              nlevels, empty, hmin, hmax (height range, m), node
+              and row
+    """
+    rows = list()
+    for thetime, dataframe, node, row in entries:
+        empty = dataframe is None or len(dataframe) <= 1
+        hmin, hmax = (np.nan, np.nan) if empty else \
+            height_range(dataframe['hght'].values)
+        rows.append(dict(station=station,
+                         nlevels=0 if empty else len(dataframe),
+                         empty=empty, hmin=hmin, hmax=hmax,
+                         node=node, row=row))
+    times = pd.DatetimeIndex([thetime for thetime, _, _, _ in entries],
+                             name='launch')
+    frame = pd.DataFrame(rows, index=times,
+                         columns=['station', 'nlevels', 'empty', 'hmin',
+                                  'hmax', 'node', 'row'])
+    return frame.astype(dict(station=str, nlevels=np.int32, empty=bool,
+                             hmin=np.float32, hmax=np.float32, node=str,
+                             row=np.int64))
+
+
+def write_catalog(out_name, frame, mode='w'):
+    """
+    Store the catalog (catalog_frame) of an archive in
+    catalog_name(out_name); the last row of a repeated time is
+    kept. Mode 'a' merges it into the stored one, new rows winning
+    on equal times, or scans an hdf archive that has none yet
+    """
+    if len(frame) == 0 and mode == 'a':
+        return
+    # a time can come twice, e.g. from a single-date and a month page
+    frame = frame[~frame.index.duplicated(keep='last')]
+    filename = catalog_name(out_name)
+    if mode == 'a' and not os.path.exists(filename) and \
+            os.path.isfile(out_name):
+        # archive written before it had a catalog: list all of it
+        frame = scan_catalog(out_name)
+    elif mode == 'a' and os.path.exists(filename):
+        old = pd.read_hdf(filename, 'catalog')
+        old = old[~old.index.isin(frame.index)]
+        frame = pd.concat([old, frame]).sort_index()
+    # compressed and without pytables indices: a year is ~15 kB
+    frame.to_hdf(filename, key='catalog', mode='w', format='table',
+                 data_columns=True, index=False, complevel=9,
+                 complib='blosc:zstd')
+
+
+def read_catalog(out_name):
+    """
+    Catalog of an archive (see catalog_frame), read from its
+    catalog file; zarr stores carry theirs in the store, as the
+    time, nlevels, hmin and hmax arrays of the soundings written
+    """
+    if out_name.endswith('.zarr'):
+        import zarr
+
+        group = zarr.open_group(out_name, mode='r')
+        nlevels = group['nlevels'][:]
+        rows = np.flatnonzero(nlevels > 0)
+        frame = pd.DataFrame(
+            dict(station=group.attrs.get('site_id', ''),
+                 nlevels=nlevels[rows], empty=False,
+                 hmin=group['hmin'].oindex[rows],
+                 hmax=group['hmax'].oindex[rows], node='', row=rows),
+            index=pd.DatetimeIndex(pd.to_datetime(
+                group['time'].oindex[rows], unit='s'), name='launch'))
+        return frame
+    return pd.read_hdf(catalog_name(out_name), 'catalog')
+
+
+def scan_catalog(out_name):
+    """
+    Build the catalog of an hdf archive (table or dense layout)
+    from its content, for files written without one
+
+    The data block of each sounding (values_block_0 of the table
+    layout, stored row by row) is read whole and only its height
+    column kept; the dense layout reads the hght dataset.
+    """
+    entries = list()
+    with h5py.File(out_name, 'r') as f:
+        station = str(f.attrs.get('site_id', ''))
+        if f.attrs.get('layout') == 'dense':
+            times = pd.to_datetime(f['time'][:], unit='s')
+            nlevels = f['nlevels'][:]
+            hght = f['hght'][:]
+            for row, thetime in enumerate(times):
+                df = pd.DataFrame(dict(hght=hght[row, :nlevels[row]]))
+                entries.append((thetime, df, '', row))
+        else:
+            for key in f.keys():
+                table = f[key]['table']
+                values = table['values_block_0'] if table.shape[0] > 1 \
+                    else None
+                df = None if values is None else \
+                    pd.DataFrame(dict(hght=values[:, 1]))
+                thetime = pd.to_datetime(key, format='Y%Y%m%dZ%H')
+                entries.append((thetime, df, key, -1))
+    return catalog_frame(entries, station).sort_index()
+
+
+# Each sounding on a page is titled with its launch time:
+# <H2>85799 SCTE Puerto Montt Observations at 00Z 01 Jan 2019</H2>
+obs_time_re = re.compile(r'Observations\s+at\s+(\d{2})Z\s+(\d{1,2})'
+                         r'\s+(\w{3})\s+(\d{4})')
+
+
+def parse_obs_time(title_text):
+    """
+    Return the launch time in a sounding title as pd.Timestamp,
+    or None if the title has no observation time; raise ParseError
+    if the time cannot be read
+    """
+    match = obs_time_re.search(title_text)
+    if match is None:
+        return None
+    hour, day, month, year = match.groups()
+    try:
+        return pd.to_datetime('{} {} {} {}'.format(year, month, day, hour),
+                              format='%Y %b %d %H')
+    except ValueError:
+        raise ParseError('bad observation time in title', title_text)
+
 
 def parse_header(header_text):
     """
@@ -118,26 +500,63 @@ def parse_header(header_text):
     """
     header_text = header_text.strip()
     the_match = header_re.match(header_text)
-    try:
-        the_id, string_time, lat, lon, elev = the_match.groups()
-    except AttributeError:
-        print('parse failure with: \n', header_text)
+    if the_match is None:
+        raise ParseError('no station information found in header',
+                         header_text)
     the_id, string_time, lat, lon, elev = the_match.groups()
     elev = elev.split('\n')[
         0]  # some soundings follow elev with Shoalwater, not Lifted
-    lat = float(lat)
-    lon = float(lon)
-    elev = float(elev)
-    day, hour = string_time.strip().split('/')
-    #	year=int(day[:2]) + 2000
-    #	month=int(day[2:4])
-    day = int(day[4:6])
-    #	minute=int(hour[2:])
-    hour = int(hour[:2])
+    try:
+        lat = float(lat)
+        lon = float(lon)
+        elev = float(elev)
+        day, hour = string_time.strip().split('/')
+        #	year=int(day[:2]) + 2000
+        #	month=int(day[2:4])
+        day = int(day[4:6])
+        #	minute=int(hour[2:])
+        hour = int(hour[:2])
+    except ValueError:
+        raise ParseError('bad station information in header', header_text)
 
     return the_id, lat, lon, elev
 
 
+def decode_fixed_width(lines, ncols=11, width=7):
+    """
+    Convert lines of fixed-width numeric fields into a 2-D array
+
+    All lines are packed into one byte buffer viewed as an
+    (nlines, ncols) array of ``width``-byte fields and converted
+    in one numpy cast; blank fields (and the missing tail of short
+    lines) become NaN.
+
+    Parameters
+    ----------
+
+    lines : list of str
+            data lines, e.g. of a wyoming sounding
+
+    ncols : int
+            number of fields per line
+
+    width : int
+            characters per field
+
+    Returns
+    -------
+
+    values : np.ndarray
+             float64 array of shape (len(lines), ncols)
+    """
+    linesize = ncols * width
+    buf = ''.join([line.strip('\r\n')[:linesize].ljust(linesize)
+                   for line in lines]).encode()
+    fields = np.frombuffer(buf, dtype='S{}'.format(width)).copy()
+    fields[fields == b' ' * width] = b'nan'
+    return fields.astype(np.float64).reshape(len(lines), ncols)
+
+
 def parse_data(data_text):
     """
     Read a single sounding into a dataframe
@@ -159,8 +578,6 @@ def parse_data(data_text):
 
     """
 
-    import struct
-
     """
         read lines with 11 numbers and convert to dataframe
 
@@ -193,14 +610,12 @@ def parse_data(data_text):
             count += 1
             theLine = all_lines[count]
         header_names = all_lines[count].lower().split()
+        count += 1  # go to unit names
+        unit_names = all_lines[count].split()
     except IndexError:
-        print("no column header line found in sounding")
-        sys.exit(1)
-    count += 1  # go to unit names
-    unit_names = all_lines[count].split()
+        raise ParseError('no column header line found in sounding',
+                         data_text)
     count += 2  # skip a row of ------
-    data_list = []
-    
     # while True:
     #     try:
     #         the_line = all_lines[count]
@@ -234,29 +649,141 @@ def parse_data(data_text):
     #     except IndexError:
     #         break
 
-    for r in range(count, len(all_lines)-1):
+    try:
+        values = decode_fixed_width(all_lines[count:len(all_lines)-1],
+                                    ncols=len(header_names))
+    except ValueError:
+        raise ParseError('non-numeric field in sounding data', data_text)
+    df_out = pd.DataFrame(values, columns=header_names)
+    return df_out, unit_names
+
 
-        fmtstring = '7s 7s 7s 7s 7s 7s 7s 7s 7s 7s 7s'
-        fieldstruct = struct.Struct(fmtstring)
-        parse = fieldstruct.unpack_from
-        the_line = all_lines[r]
-        # print r, the_line
-        dataFields = parse(the_line.strip('\r\n').encode())
+# The wyoming pages are flat: every sounding is a <h2> title and two
+# <pre> blocks (data, then station information and indices) holding
+# plain text, so the blocks can be cut out of the raw bytes directly.
 
-        empty = '       '.encode()
-        dataFields = [float(number) if empty not in number else np.nan for number in dataFields]
 
-        data_list.append(dataFields)
+def _tag_texts(html_doc, lower, tag):
+    # texts between <tag> and </tag>, found on the lower-cased copy
+    opening = b'<' + tag + b'>'
+    closing = b'</' + tag + b'>'
+    texts = list()
+    begin = lower.find(opening)
+    while begin >= 0:
+        begin += len(opening)
+        end = lower.find(closing, begin)
+        if end < 0:
+            break
+        texts.append(html_doc[begin:end])
+        begin = lower.find(opening, end)
+    return texts
 
-    df_out = pd.DataFrame.from_records(data_list,
-                                       columns=header_names)
-    return df_out, unit_names
+
+def extract_blocks(html_doc):
+    """
+    Fast extraction of the <h2> and <pre> texts of a wyoming page
+
+    Returns (titles, pres) as lists of str, or None when the page
+    does not have the expected layout (odd number of <pre> blocks,
+    tags with attributes, nested tags or html entities), in which
+    case the caller should fall back to BeautifulSoup
+    """
+    if isinstance(html_doc, str):
+        html_doc = html_doc.encode('utf-8')
+    lower = html_doc.lower()
+    pres = _tag_texts(html_doc, lower, b'pre')
+    titles = _tag_texts(html_doc, lower, b'h2')
+    if len(pres) % 2:
+        return None
+    # tags with attributes (<PRE class=...>) are left to BeautifulSoup
+    if lower.count(b'<pre') != len(pres) or \
+            lower.count(b'<h2') != len(titles):
+        return None
+    for block in itertools.chain(pres, titles):
+        if b'<' in block or b'&' in block:
+            return None
+    return ([t.decode('utf-8', errors='replace') for t in titles],
+            [p.decode('utf-8', errors='replace') for p in pres])
+
+
+def soup_blocks(html_doc):
+    """
+    Extract the <h2> and <pre> texts of a page with BeautifulSoup
+    """
+    soup = BeautifulSoup(html_doc, 'html.parser')
+    return ([item.text for item in soup.find_all('h2')],
+            [item.text for item in soup.find_all('pre')])
+
+
+def iter_frames(html_doc, fast=True, errors=None):
+    """
+    Parse every sounding on an html page retrieved from the
+    wyoming site, in page order
+
+    Parameters
+    ----------
+
+    html_doc : string
+                         web page from wyoming upperair sounding site,
+                         holding one or more soundings (FROM != TO)
+
+    fast : bool
+                         cut the blocks out with extract_blocks,
+                         falling back to BeautifulSoup on unexpected
+                         markup; False always uses BeautifulSoup
+
+    errors : ErrorReport, optional
+                         soundings raising ParseError are recorded
+                         here and skipped; without it the error is
+                         raised
+
+    Yields
+    ------
+
+    thetime : pd.Timestamp
+                         launch time from the sounding title
+                         (None if the title carries no time)
+
+    attr_dict : dict
+                         attr_dict dictionary with
+                         ['header', 'site_id','longitude','latitude',
+                         'elevation', 'units', 'indices'], indices
+                         being the dict of parse_indices
+
+    df : dataframe
+                         11 column data frame with sounding values
+    """
+    blocks = extract_blocks(html_doc) if fast else None
+    if blocks is None:
+        blocks = soup_blocks(html_doc)
+    titles, keep = blocks
+
+    for n, count in enumerate(range(0, len(keep) - 1, 2)):
+        header = titles[n] if n < len(titles) else ''
+        thetime = None
+        try:
+            thetime = parse_obs_time(header)
+            df, units = parse_data(keep[count])
+            the_id, lat, lon, elev = parse_header(keep[count + 1])
+            indices = parse_indices(keep[count + 1])
+        except ParseError as err:
+            if errors is None:
+                raise
+            errors.add(thetime, header, err.reason, err.text)
+            continue
+        attr_dict = dict(units=';'.join(units), site_id=the_id,
+                         latitude=lat, longitude=lon, elevation=elev,
+                         header=header, indices=indices)
+        yield thetime, attr_dict, df
 
 
-def make_frames(html_doc):
+def make_frames(html_doc, errors=None):
     """
     turn an html page retrieved from the wyoming site into a dataframe
 
+    Pages with several soundings return the last one; use
+    iter_frames to get all of them.
+
     Parameters
     ----------
 
@@ -265,6 +792,10 @@ def make_frames(html_doc):
                          http://weather.uwyo.edu/cgi-bin/sounding
                          retrieved by the urllib module
 
+    errors : ErrorReport, optional
+                         collect parse failures instead of raising
+                         ParseError (see iter_frames)
+
     Returns
     -------
 
@@ -273,306 +804,2206 @@ def make_frames(html_doc):
                          ['header', 'site_id','longitude','latitude',
                          'elevation', 'units']
 
-    sound_dict : dict
-                             sounding dictionary with sounding times
-                             as keys and sounding as dataframes
-    """
-    soup = BeautifulSoup(html_doc, 'html.parser')
-    keep = list()
-    #	sounding_dict=dict()
-    pre = soup.find_all('pre')
-    # print(len(pre))
-    if len(pre) > 0:
-        for item in pre:
-            keep.append(item.text)
-
-        evens = np.arange(0, len(keep), 2)
-        for count in evens:
-            df, units = parse_data(keep[count])
-            the_id, lat, lon, elev = parse_header(keep[count + 1])
+    df : dataframe
+                         11 column data frame with sounding values
 
-        header = soup.find_all('h2')[0].text
-        attr_dict = dict(units=';'.join(units), site_id=the_id,
-                         latitude=lat, longitude=lon, elevation=elev,
-                         header=header)
+    resp : str
+                         'OK', 'NO SOUNDING' or 'PARSE ERROR' (only
+                         with errors)
+    """
+    failed = 0 if errors is None else len(errors)
+    frames = list(iter_frames(html_doc, errors=errors))
+    if len(frames) > 0:
+        _, attr_dict, df = frames[-1]
         resp = 'OK'
+    elif errors is not None and len(errors) > failed:
+        attr_dict = dict()
+        df = pd.DataFrame(np.nan,
+                          index=[0],
+                          columns=['data'])
+        resp = 'PARSE ERROR'
     else:
-
         attr_dict = dict()
         df = pd.DataFrame(np.nan,
                           index=[0],
                           columns=['data'])
         resp = 'NO SOUNDING'
 
-    # html_doc.close()
-
     return attr_dict, df, resp
 
 
-def download_wyoming(region=None, station=None, year=None,
-                     date=None, dates=None, out_directory=None):
+class RateLimiter:
     """
-    function to test downloading a sounding
-    from http://weather.uwyo.edu/cgi-bin/sounding and
-    creating an hdf file with soundings and attributes
+    Thread-safe token bucket
 
-    see the notebook newsoundings.ipynb for use
+    Allows ``rate`` acquisitions per second on average with bursts
+    of up to ``burst``; acquire blocks until a token is available.
     """
 
-    st_num = station['number']
-    st_name = station['name']
+    def __init__(self, rate, burst=1):
+        self.rate = float(rate)
+        self.burst = float(burst)
+        self.tokens = float(burst)
+        self.stamp = time.monotonic()
+        self.lock = threading.Lock()
+
+    def acquire(self):
+        while True:
+            with self.lock:
+                now = time.monotonic()
+                self.tokens = min(self.burst,
+                                  self.tokens + (now - self.stamp) * self.rate)
+                self.stamp = now
+                if self.tokens >= 1.:
+                    self.tokens -= 1.
+                    return
+                wait = (1. - self.tokens) / self.rate
+            time.sleep(wait)
+
+
+class WyomingSession:
+    """
+    Reusable HTTP session for the wyoming sounding site.
 
-    url_template = ("http://weather.uwyo.edu/cgi-bin/sounding?"
-                    "region={region:s}"
-                    "&TYPE=TEXT%3ALIST"
-                    "&YEAR={year:s}"
-                    "&MONTH={month:s}"
-                    "&FROM={start:s}"
-                    "&TO={stop:s}"
-                    "&STNM={station:s}")
+    Wraps a single urllib3.PoolManager so that consecutive requests
+    reuse keep-alive connections instead of paying a new TCP/DNS
+    setup per sounding. Create it once and pass it to
+    download_wyoming/download_wyoming_netcdf through the ``session``
+    keyword, or let them use the module-wide default session.
 
-    name_template = out_directory + '/wyoming_{0}_{1}_{2}.h5'
+    Parameters
+    ----------
 
-    # Parse date to download and output h5 name
-    if date and year is None and dates is None:
-        dates = pd.date_range(start=date,
-                              periods=1,
-                              freq='12H')
-        dstr = dates[0].strftime('%Y%m%d%H')
-        out_name = name_template.format(region, st_name, dstr)
-    elif dates and date is None and year is None:
-        date0 = dates[0]
-        date1 = dates[1]
-        dates = pd.date_range(start=date0,
-                              end=date1,
-                              freq='12H')
-        dstr = dates[0].strftime('%Y%m%d%H-') + \
-               dates[-1].strftime('%Y%m%d%H')
-        out_name = name_template.format(region, st_name, dstr)
-    else:
-        yr = str(year)
-        dates = pd.date_range(start=yr + '-01-01 00:00',
-                              end=yr + '-12-31 12:00',
-                              freq='12H')
-        out_name = name_template.format(region, st_name, yr)
+    num_pools : int
+                number of host connection pools kept in the manager
 
-    # start downloading for each date
-    with pd.HDFStore(out_name, 'w') as store:
+    maxsize : int
+              maximum number of connections kept alive per host
 
-        for date in dates:
+    block : bool
+            if True, never open more than ``maxsize`` connections
+            per host (callers wait for a free connection)
 
-            values = dict(region=region,
-                          year=date.strftime('%Y'),
-                          month=date.strftime('%m'),
-                          start=date.strftime('%d%H'),
-                          stop=date.strftime('%d%H'),
-                          station=st_num)
+    retries : int or urllib3.util.Retry
+              retry policy; an int is expanded to a Retry with
+              exponential backoff on connection errors and 5xx/429
 
-            url = url_template.format(**values)
-            print(url)
-            # old urllib function
-            # html_doc = urllib.request.urlopen(url)
+    timeout : float or tuple
+              total timeout in seconds, or (connect, read) tuple
 
-            http = urllib3.PoolManager()
-            response = http.request('GET', url)
-            html_doc = response.data
+    backoff_factor : float
+                     backoff factor used when ``retries`` is an int
 
-            at_dict, sounding_df, resp = make_frames(html_doc)
-            if resp == 'OK':
-                attr_dict = at_dict
-            else:
-                attr_dict = dict()
+    rate : float, optional
+           maximum requests per second over all threads using
+           this session (token bucket); None means unlimited
 
-            print_str = 'Read/Write sounding date {}: {}'
-            print_date = date.strftime('%Y-%m-%d_%HZ')
-            print(print_str.format(print_date, resp))
+    burst : int
+            token bucket size, i.e. requests allowed back to back
 
-            thetime = date.strftime("Y%Y%m%dZ%H")
-            
-            r = xr.Dataset.from_dataframe(sounding_df)
-            r.to_netcdf(out_name.split('.')[0]+'__'+thetime+'.nc')
-            store.put(thetime, sounding_df, format='table')
+    cache : wyoming_cache.ResponseCache, optional
+            raw page cache consulted before the network; successful
+            responses are stored in it
+    """
 
-    attr_dict['history'] = "written by wyominglib.py"
-    key_list = ['header', 'site_id', 'longitude', 'latitude',
-                'elevation', 'units', 'history']
+    def __init__(self, num_pools=4, maxsize=4, block=True,
+                 retries=3, timeout=(10., 60.), backoff_factor=0.5,
+                 rate=None, burst=1, cache=None):
 
-    with h5py.File(out_name, 'a') as f:
-        print('Writing HDF5 file attributes')
-        for key in key_list:
-            try:
-                print('writing key, value: ', key, attr_dict[key])
-                f.attrs[key] = attr_dict[key]
-            except KeyError:
-                pass
-        f.close()
+        from urllib3.util import Retry, Timeout
 
-    print('hdf file {} written'.format(out_name))
-    print('reading attributes: ')
-    with h5py.File(out_name, 'r') as f:
-        keys = f.attrs.keys()
-        for key in keys:
-            try:
-                print(key, f.attrs[key])
-            except OSError:
-                pass
+        if isinstance(retries, int):
+            retries = Retry(total=retries,
+                            backoff_factor=backoff_factor,
+                            status_forcelist=(429, 500, 502, 503, 504),
+                            allowed_methods=frozenset(['GET']))
+        if isinstance(timeout, tuple):
+            timeout = Timeout(connect=timeout[0], read=timeout[1])
+        else:
+            timeout = Timeout(total=timeout)
+
+        self.retries = retries
+        self.timeout = timeout
+        self.limiter = None if rate is None else RateLimiter(rate, burst)
+        self.cache = cache
+        self.http = urllib3.PoolManager(num_pools=num_pools,
+                                        maxsize=maxsize,
+                                        block=block,
+                                        retries=retries,
+                                        timeout=timeout,
+                                        headers={'Connection': 'keep-alive'})
+
+    def get(self, url, **kwargs):
+        """
+        GET ``url`` through the pooled connections and
+        return the response body as bytes
 
-def write_sounding_netcdf(filename,dataframe,time):
+        Only regular answers (is_answer) go to the cache, not
+        busy or error pages served with status 200.
+        """
+        if self.cache is not None:
+            data = self.cache.get(url)
+            if data is not None:
+                return data
+        if self.limiter is not None:
+            self.limiter.acquire()
+        response = self.http.request('GET', url, **kwargs)
+        if self.cache is not None and response.status == 200 and \
+                is_answer(response.data):
+            self.cache.put(url, response.data)
+        return response.data
+
+    def stream(self, url, chunk_size=65536, **kwargs):
+        """
+        GET ``url`` and yield the response body in chunks as it
+        arrives, without holding the whole page in memory
+
+        With a cache the page is still stored once complete, if it
+        is a regular answer (and a cached page is yielded as a
+        single chunk).
+        """
+        if self.cache is not None:
+            data = self.cache.get(url)
+            if data is not None:
+                yield data
+                return
+        if self.limiter is not None:
+            self.limiter.acquire()
+        response = self.http.request('GET', url, preload_content=False,
+                                     **kwargs)
+        keep = None
+        if self.cache is not None and response.status == 200:
+            keep = list()
+        try:
+            for chunk in response.stream(chunk_size):
+                if keep is not None:
+                    keep.append(chunk)
+                yield chunk
+        finally:
+            response.release_conn()
+        if keep is not None:
+            data = b''.join(keep)
+            if is_answer(data):
+                self.cache.put(url, data)
+
+    def close(self):
+        self.http.clear()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+_default_session = None
+
+
+def get_session():
     """
-    Write sounding data to netcdf files
+    Return the module-wide WyomingSession, creating it on first use
     """
-    from netCDF4 import Dataset, date2num
-    import datetime
-    import sys
+    global _default_session
+    if _default_session is None:
+        _default_session = WyomingSession()
+    return _default_session
 
-    nc = Dataset(filename, 'w')
-    dim_rec = nc.createDimension('time', None)
-    dim_t = nc.createDimension('level', len(dataframe.hght))
-    
-    var_time = nc.createVariable('time',np.float64,('time'))
-    var_time.description = 'Observation time'
-    var_time.units = "seconds since 1970-01-01 00:00:00"
-    var_time.calendar = "standard"
-    var_time.axis="T"
-    var_hgt = nc.createVariable('height', np.float64, ('time', 'level',))
-    var_hgt.units = "m"
-    var_hgt.axis = "Y"
-    var_hgt.description = "height above sea level"
-    var_pres = nc.createVariable('pressure', np.float, ('time', 'level',))
-    var_pres.units = 'hPa'
-    var_temp = nc.createVariable('temperature', np.float, ('time', 'level',))
-    var_temp.units = 'deg C'
-    var_tau = nc.createVariable('dewpoint', np.float, ('time', 'level',))
-    var_tau.units = 'deg C'
-    var_rh = nc.createVariable('relative_humidity', np.float, ('time', 'level',))
-    var_rh.units = 'RH'
-    var_q = nc.createVariable('mixing_ratio', np.float, ('time', 'level',))
-    var_q.units = 'g kg^-1'
-    var_dir = nc.createVariable('wind_dir', np.float, ('time', 'level',))
-    var_dir.units = 'degrees'
-    var_spd = nc.createVariable('wind_speed', np.float, ('time', 'level',))
-    var_spd.units = 'knots'
-    var_theta_a = nc.createVariable('theta_a', np.float, ('time', 'level',))
-    var_theta_a.units = 'K'
-    var_theta_e = nc.createVariable('theta_e', np.float, ('time', 'level',))
-    var_theta_e.units = 'K'
-    var_theta_v = nc.createVariable('theta_v', np.float, ('time', 'level',))
-    var_theta_v.units = 'K'
-    
-    nc.title = 'Atmospheric soundings'
-    nc.creation_date = datetime.datetime.now().strftime("%d/%m%/%Y %H:%M")
-    nc.environment = 'env:{}, numpy:{}'.format(sys.version,np.__version__)
-
-    var_time[:] = date2num(time, "seconds since 1970-01-01")
-    var_hgt[0,:] = dataframe.hght.values
-    var_pres[0,:] = dataframe.pres.values
-    var_temp[0,:] = dataframe.temp.values
-    var_tau[0,:] = dataframe.dwpt.values
-    var_rh[0,:] = dataframe.relh.values
-    var_q[0,:] = dataframe.mixr.values
-    var_dir[0,:] = dataframe.drct.values
-    var_spd[0,:] = dataframe.sknt.values
-    var_theta_a[0,:] = dataframe.thta.values
-    var_theta_e[0,:] = dataframe.thte.values
-    var_theta_v[0,:] = dataframe.thtv.values
 
-    
-    nc.close()
+# sounding CGI; point it to another server (e.g. wyoming_server)
+# for offline tests
+base_url = "http://weather.uwyo.edu/cgi-bin/sounding"
 
-def download_wyoming_netcdf(region=None, station=None, year=None,
-                     date=None, dates=None, out_directory=None):
+url_template = ("{base:s}?"
+                "region={region:s}"
+                "&TYPE=TEXT%3ALIST"
+                "&YEAR={year:s}"
+                "&MONTH={month:s}"
+                "&FROM={start:s}"
+                "&TO={stop:s}"
+                "&STNM={station:s}")
+
+h2_re = re.compile(r'<h2>', re.IGNORECASE)
+
+
+def make_url(region, station, start, stop=None):
     """
-    function to test downloading a sounding
-    from http://weather.uwyo.edu/cgi-bin/sounding and
-    creating an hdf file with soundings and attributes
+    Build a sounding url for the FROM/TO window start..stop
 
-    see the notebook newsoundings.ipynb for use
+    The wyoming CGI takes a single YEAR/MONTH, so start and
+    stop must fall in the same month. If stop is None a single
+    sounding (start == stop) is requested.
     """
+    start = pd.Timestamp(start)
+    stop = start if stop is None else pd.Timestamp(stop)
+    if (start.year, start.month) != (stop.year, stop.month):
+        raise ValueError('start and stop must be in the same month')
+    values = dict(base=base_url,
+                  region=region,
+                  year=start.strftime('%Y'),
+                  month=start.strftime('%m'),
+                  start=start.strftime('%d%H'),
+                  stop=stop.strftime('%d%H'),
+                  station=station)
+    return url_template.format(**values)
+
+
+def split_soundings(html_doc):
+    """
+    Split a page holding several soundings (FROM != TO) into
+    one html chunk per sounding
 
-    st_num = station['number']
-    st_name = station['name']
+    Parameters
+    ----------
 
-    url_template = ("http://weather.uwyo.edu/cgi-bin/sounding?"
-                    "region={region:s}"
-                    "&TYPE=TEXT%3ALIST"
-                    "&YEAR={year:s}"
-                    "&MONTH={month:s}"
-                    "&FROM={start:s}"
-                    "&TO={stop:s}"
-                    "&STNM={station:s}")
+    html_doc : bytes or str
+               web page from wyoming upperair sounding site
 
-    name_template = out_directory + '/wyoming_{0}_{1}_{2}.nc'
+    Returns
+    -------
 
-    # Parse date to download and output h5 name
-    if date and year is None and dates is None:
-        dates = pd.date_range(start=date,
-                              periods=1,
-                              freq='12H')
-        dstr = dates[0].strftime('%Y%m%d%H')
-        out_name = name_template.format(region, st_name, dstr)
-    elif dates and date is None and year is None:
-        date0 = dates[0]
-        date1 = dates[1]
-        dates = pd.date_range(start=date0,
-                              end=date1,
-                              freq='12H')
-        dstr = dates[0].strftime('%Y%m%d%H-') + \
-               dates[-1].strftime('%Y%m%d%H')
-        out_name = name_template.format(region, st_name, dstr)
-    else:
-        yr = str(year)
-        dates = pd.date_range(start=yr + '-01-01 00:00',
-                              end=yr + '-12-31 12:00',
-                              freq='12H')
-        out_name = name_template.format(region, st_name, yr)
+    chunks : dict
+             sounding times (pd.Timestamp) as keys and the html
+             of each sounding (its <h2> and <pre> blocks) as values;
+             each chunk can be passed to make_frames
+    """
+    if isinstance(html_doc, bytes):
+        html_doc = html_doc.decode('utf-8', errors='replace')
+
+    starts = [m.start() for m in h2_re.finditer(html_doc)]
+    chunks = dict()
+    for begin, end in zip(starts, starts[1:] + [len(html_doc)]):
+        chunk = html_doc[begin:end]
+        thetime = parse_obs_time(chunk)
+        if thetime is None or '<pre>' not in chunk.lower():
+            continue
+        chunks[thetime] = chunk
+    return chunks
 
-    # start downloading for each date
-    for date in dates:
-        values = dict(region=region,
-                      year=date.strftime('%Y'),
-                      month=date.strftime('%m'),
-                      start=date.strftime('%d%H'),
-                      stop=date.strftime('%d%H'),
-                      station=st_num)
-
-        url = url_template.format(**values)
-        print(url)
-        # old urllib function
-        # html_doc = urllib.request.urlopen(url)
-
-        http = urllib3.PoolManager()
-        response = http.request('GET', url)
-        html_doc = response.data
-
-        at_dict, sounding_df, resp = make_frames(html_doc)
-        if resp == 'OK':
-            attr_dict = at_dict
-        else:
-            attr_dict = dict()
 
-        print_str = 'Read/Write sounding date {}: {}'
-        print_date = date.strftime('%Y-%m-%d_%HZ')
-        print(print_str.format(print_date, resp))
+def split_stream(chunks, rest=None):
+    """
+    Incremental split_soundings: consume a page in chunks (bytes)
+    and yield (time, html) for each sounding as soon as its
+    second </pre> block has arrived
 
-        if resp == "NO SOUNDING":
-            continue
-        thetime = date.strftime("%Y%m%d%H")
+    Only the unfinished sounding is kept in memory. If rest is a
+    list, what is left of the page after the last sounding (the
+    whole page if it held none) is appended to it.
+    """
+    buf = b''
+    for chunk in chunks:
+        buf += chunk
+        while True:
+            lower = buf.lower()
+            first = lower.find(b'</pre>')
+            if first < 0:
+                break
+            second = lower.find(b'</pre>', first + len(b'</pre>'))
+            if second < 0:
+                break
+            end = second + len(b'</pre>')
+            piece = buf[:end].decode('utf-8', errors='replace')
+            buf = buf[end:]
+            thetime = parse_obs_time(piece)
+            if thetime is not None:
+                yield thetime, piece
+    if rest is not None:
+        rest.append(buf)
+
+
+def stream_frames(chunks):
+    """
+    Parse a page while it downloads: like iter_frames, but fed
+    with chunks (e.g. WyomingSession.stream), yielding
+    (time, attrs, frame) as each sounding completes
+    """
+    for _, piece in split_stream(chunks):
+        for frame in iter_frames(piece):
+            yield frame
 
-        # Find main levels
-        main_levels = [1000,925,850,700,500,400,300,200,100]
 
-        print(sounding_df.pres.values)
+def make_windows(dates, batch='month'):
+    """
+    Group dates into FROM/TO request windows
 
-        idx = np.where(np.in1d(sounding_df.pres.values,main_levels))[0]
-        if len(idx) != len(main_levels):
-            print("Not all requestested levels ({}) available: {}".format(main_levels,sounding_df.pres.values))
-            continue
+    Parameters
+    ----------
+
+    dates : pd.DatetimeIndex
+            sounding times to download
+
+    batch : 'month' or int
+            one window per calendar month, or windows of
+            ``batch`` days that never cross a month boundary
+
+    Returns
+    -------
+
+    windows : list
+              list of (start, stop, dates_in_window) tuples
+    """
+    dates = pd.DatetimeIndex(dates)
+    if batch == 'month':
+        keys = dates.year * 100 + dates.month
+    else:
+        keys = (dates.year * 100 + dates.month) * 100 + \
+               (dates.day - 1) // int(batch)
+    windows = list()
+    for key in pd.unique(keys):
+        members = dates[keys == key]
+        windows.append((members[0], members[-1], members))
+    return windows
+
+
+# one download: the url of a FROM/TO window (None if every date in it
+# is a known gap), the sounding times it covers and those actually
+# requested (inside FROM/TO and not known gaps)
+Job = collections.namedtuple('Job', 'region station url dates split wanted')
+
+
+def has_sounding(html_doc):
+    """ True if html_doc holds at least one sounding """
+    if isinstance(html_doc, bytes):
+        html_doc = html_doc.decode('utf-8', errors='replace')
+    return '<pre' in html_doc.lower()
+
+
+def is_answer(html_doc):
+    """
+    True if html_doc is a regular answer of the sounding CGI, i.e.
+    soundings or the "Can't get ..." message, rather than an error
+    or throttling page
+    """
+    if isinstance(html_doc, bytes):
+        html_doc = html_doc.decode('utf-8', errors='replace')
+    html_doc = html_doc.lower()
+    return '<pre' in html_doc or "can't get" in html_doc
+
+
+def make_jobs(region, station, dates, batch=None, skip=()):
+    """
+    Turn sounding times into download jobs (see Job)
+
+    split says whether the page holds a FROM/TO window that must be
+    split into single soundings. Dates in skip (known gaps) are not
+    requested; a window is narrowed to the dates left in it.
+    """
+    if batch is None:
+        jobs = list()
+        for date in dates:
+            if date in skip:
+                jobs.append(Job(region, station, None, [date], False, []))
+            else:
+                jobs.append(Job(region, station,
+                                make_url(region, station, date),
+                                [date], False, [date]))
+        return jobs
+    jobs = list()
+    for _, _, members in make_windows(dates, batch=batch):
+        wanted = [date for date in members if date not in skip]
+        url = None
+        if wanted:
+            url = make_url(region, station, wanted[0], wanted[-1])
+        jobs.append(Job(region, station, url, members, True, wanted))
+    return jobs
+
+
+def run_job(session, job, missing=None):
+    """
+    Download one job from make_jobs and return a list
+    of (date, html_doc) pairs, one per date in the job
+
+    If missing (wyoming_cache.MissingCache) is given, requested
+    dates (job.wanted) found without a sounding are recorded in it,
+    and found ones cleared.
+    """
+    if job.url is None:
+        return [(date, '') for date in job.dates]
+
+    print(job.url)
+    html_doc = session.get(job.url)
+    if job.split:
+        chunks = split_soundings(html_doc)
+        pairs = [(date, chunks.get(date, '')) for date in job.dates]
+    else:
+        pairs = [(job.dates[0], html_doc)]
+
+    if missing is not None and is_answer(html_doc):
+        wanted = set(job.wanted)
+        for date, chunk in pairs:
+            if date in wanted:
+                missing.update(job.region, job.station, date,
+                               has_sounding(chunk))
+    return pairs
+
+
+def stream_job(session, job, missing=None):
+    """
+    Streaming run_job: yield the (date, html_doc) pairs of a
+    FROM/TO window as its soundings arrive
+
+    Gaps are recorded in missing once the window has delivered
+    at least one sounding, or the page is a regular answer
+    without soundings (see is_answer).
+    """
+    if job.url is None or not job.split:
+        for pair in run_job(session, job, missing):
+            yield pair
+        return
+
+    print(job.url)
+    dates = list(job.dates)
+    absent = list()
+    answered = False
+    rest = list()
+    n = 0
+    for thetime, piece in split_stream(session.stream(job.url), rest):
+        answered = True
+        while n < len(dates) and dates[n] < thetime:
+            absent.append(dates[n])
+            yield dates[n], ''
+            n += 1
+        if n < len(dates) and dates[n] == thetime:
+            if missing is not None:
+                missing.update(job.region, job.station, thetime, True)
+            yield thetime, piece
+            n += 1
+    for date in dates[n:]:
+        absent.append(date)
+        yield date, ''
+
+    if not answered:
+        answered = is_answer(b''.join(rest))
+    if missing is not None and answered:
+        wanted = set(job.wanted)
+        for date in absent:
+            if date in wanted:
+                missing.update(job.region, job.station, date, False)
+
+
+def imap_bounded(func, items, workers):
+    """
+    Apply func to items on a thread pool and yield the results
+    in input order
+
+    At most 2 * workers calls are submitted ahead of the consumer,
+    so a slow consumer throttles the downloads instead of piling
+    up pages in memory.
+    """
+    from concurrent.futures import ThreadPoolExecutor
+
+    if workers <= 1:
+        for item in items:
+            yield func(item)
+        return
+
+    executor = ThreadPoolExecutor(max_workers=workers)
+    try:
+        pending = collections.deque()
+        for item in items:
+            pending.append(executor.submit(func, item))
+            if len(pending) >= 2 * workers:
+                yield pending.popleft().result()
+        while pending:
+            yield pending.popleft().result()
+    finally:
+        executor.shutdown(wait=True, cancel_futures=True)
+
+
+_done = object()
+
+
+def _put(q, value, stop):
+    # put that gives up once the consumer has gone away
+    while not stop.is_set():
+        try:
+            q.put(value, timeout=0.1)
+            return True
+        except queue.Full:
+            pass
+    return False
+
+
+def prefetch(items, maxsize=8):
+    """
+    Iterate items in a background thread and yield them through a
+    bounded queue
+
+    Chaining prefetch calls turns generators into overlapping
+    pipeline stages: the producer runs at most ``maxsize`` items
+    ahead of the consumer (backpressure), and an exception in the
+    producer is raised again in the consumer.
+    """
+    q = queue.Queue(maxsize)
+    stop = threading.Event()
+
+    def produce():
+        try:
+            for item in items:
+                if not _put(q, (None, item), stop):
+                    return
+            outcome = (None, _done)
+        except BaseException as exc:
+            outcome = (exc, _done)
+        _put(q, outcome, stop)
+
+    thread = threading.Thread(target=produce, daemon=True)
+    thread.start()
+    try:
+        while True:
+            exc, item = q.get()
+            if item is _done:
+                if exc is not None:
+                    raise exc
+                return
+            yield item
+    finally:
+        stop.set()
+
+
+def fetch_soundings(region, station, dates, session=None, batch=None,
+                    workers=1, missing=None, stream=False):
+    """
+    Download the html of each sounding in dates
+
+    Parameters
+    ----------
+
+    region : str
+             wyoming region (e.g. 'samer')
+
+    station : str
+              station number
+
+    dates : pd.DatetimeIndex
+            sounding times to download
+
+    session : WyomingSession, optional
+              defaults to the module-wide session
+
+    batch : None, 'month' or int
+            None issues one request per date; otherwise a whole
+            month (or ``batch`` days) is requested in one call and
+            split into individual soundings with split_soundings
+
+    workers : int
+              number of requests kept in flight on a thread pool;
+              results are still yielded in date order
+
+    missing : wyoming_cache.MissingCache, optional
+              known gaps are not requested (html_doc is empty);
+              newly found gaps are recorded
+
+    stream : bool
+             with batch and a single worker, read each window page in
+             chunks and yield its soundings as they arrive, so peak
+             memory is one sounding and writing starts before the
+             download finishes
+
+    Yields
+    ------
+
+    (date, html_doc) for every date; html_doc is an empty
+    string when the window holds no sounding for that date
+    or the date is a known gap
+    """
+    if session is None:
+        session = get_session()
+
+    skip = set()
+    if missing is not None:
+        skip = missing.skip(region, station, dates)
+
+    jobs = make_jobs(region, station, dates, batch=batch, skip=skip)
+    if stream and workers <= 1:
+        results = (stream_job(session, job, missing) for job in jobs)
+    else:
+        results = imap_bounded(lambda job: run_job(session, job, missing),
+                               jobs, workers)
+    try:
+        for pairs in results:
+            for pair in pairs:
+                yield pair
+    finally:
+        if missing is not None:
+            missing.flush()
+
+
+def station_dates(region, st_name, year=None, date=None, dates=None,
+                  name_template=None):
+    """
+    Expand the year/date/dates arguments of download_wyoming into
+    12-hourly sounding times and the output file name
+
+    Returns
+    -------
+
+    dates : pd.DatetimeIndex
+            sounding times to download
+
+    out_name : str
+               name_template filled with region, station and dates
+    """
+    if date and year is None and dates is None:
+        dates = pd.date_range(start=date,
+                              periods=1,
+                              freq='12h')
+        dstr = dates[0].strftime('%Y%m%d%H')
+    elif dates and date is None and year is None:
+        date0 = dates[0]
+        date1 = dates[1]
+        dates = pd.date_range(start=date0,
+                              end=date1,
+                              freq='12h')
+        dstr = dates[0].strftime('%Y%m%d%H-') + \
+               dates[-1].strftime('%Y%m%d%H')
+    else:
+        dstr = str(year)
+        dates = pd.date_range(start=dstr + '-01-01 00:00',
+                              end=dstr + '-12-31 12:00',
+                              freq='12h')
+    out_name = name_template.format(region, st_name, dstr)
+    return dates, out_name
+
+
+def stored_times(out_name):
+    """
+    Return the sounding times (pd.DatetimeIndex) that already hold
+    data in a file or zarr store written by download_wyoming (any
+    layout); times stored as 'NO SOUNDING' placeholders are left out
+
+    The archive catalog (see read_catalog) is used when there is
+    one, so only a few kilobytes are read.
+    """
+    if not os.path.exists(out_name):
+        return pd.DatetimeIndex([])
+    if out_name.endswith('.zarr'):
+        return zarr_times(out_name)
+    if os.path.exists(catalog_name(out_name)):
+        catalog = read_catalog(out_name)
+        return catalog.index[~catalog['empty'].values]
+    if os.path.isdir(out_name):
+        return parquet_times(out_name)
+    with h5py.File(out_name, 'r') as f:
+        if f.attrs.get('layout') == 'dense':
+            return pd.to_datetime(f['time'][:], unit='s')
+    times = list()
+    with pd.HDFStore(out_name, 'r') as store:
+        for key in store.keys():
+            if store.get_storer(key).nrows > 1:
+                times.append(pd.to_datetime(key.strip('/'),
+                                            format='Y%Y%m%dZ%H'))
+    return pd.DatetimeIndex(times)
+
+
+def sync_dates(out_name, dates):
+    """
+    Drop from dates the soundings already in out_name and the
+    launches that are still in the future
+
+    Returns the dates left to download and the mode
+    ('a' or 'w') to open out_name with
+    """
+    now = pd.Timestamp.now('UTC').tz_localize(None)
+    dates = dates[dates <= now]
+    if not os.path.exists(out_name):
+        return dates, 'w'
+    return dates[~dates.isin(stored_times(out_name))], 'a'
+
+
+def parse_soundings(soundings, errors=None):
+    """
+    Parse stage of the download: turn (date, html_doc) pairs into
+    (date, attr_dict, sounding_df, resp) tuples with make_frames
+
+    Soundings that fail to parse are collected in errors
+    (ErrorReport) if given, with resp 'PARSE ERROR'.
+    """
+    for date, html_doc in soundings:
+        at_dict, sounding_df, resp = make_frames(html_doc, errors=errors)
+        yield date, at_dict, sounding_df, resp
+
+
+def pipeline(soundings, queue_size=8, errors=None):
+    """
+    Fetch (soundings) and parse in background threads, each feeding
+    the next stage through a bounded queue, and return the parsed
+    soundings for the writer
+
+    Parsing and writing then hide behind network latency. With
+    queue_size 0 the stages run one after another.
+    """
+    if queue_size <= 0:
+        return parse_soundings(soundings, errors)
+    fetched = prefetch(soundings, queue_size)
+    return prefetch(parse_soundings(fetched, errors), queue_size)
+
+
+def print_sounding(date, resp):
+    """ progress line of the writers, one per sounding """
+    print_str = 'Read/Write sounding date {}: {}'
+    print_date = date.strftime('%Y-%m-%d_%HZ')
+    print(print_str.format(print_date, resp))
+
+
+sounding_columns = ['pres', 'hght', 'temp', 'dwpt', 'relh', 'mixr',
+                    'drct', 'sknt', 'thta', 'thte', 'thtv']
+
+
+class WriteBuffer:
+    """
+    Base of the sounding writers: soundings queued with append are
+    handed to ``_write`` as one list, for a single bulk write, once
+    ``flush_every`` soundings or ``max_bytes`` of frames are
+    buffered, or the oldest one has waited ``max_seconds``
+
+    Every flush is synced to disk and the writers flush on close,
+    also from a ``with`` block left by an exception, so a crash
+    loses at most the soundings of one buffer.
+
+    Parameters
+    ----------
+
+    flush_every : int
+                  soundings buffered before they are written
+
+    max_bytes : float
+                memory of the buffered frames that forces a flush
+
+    max_seconds : float
+                  age of the oldest buffered sounding that forces a
+                  flush (checked when a sounding is added)
+    """
+
+    def __init__(self, flush_every=100, max_bytes=64e6, max_seconds=60.):
+        self.flush_every = flush_every
+        self.max_bytes = max_bytes
+        self.max_seconds = max_seconds
+        self.buffer = list()
+        self.nbytes = 0
+        self.started = None
+
+    def append(self, thetime, dataframe):
+        """ queue one sounding; written on the next flush """
+        if not self.buffer:
+            self.started = time.monotonic()
+        self.buffer.append((pd.Timestamp(thetime), dataframe))
+        self.nbytes += dataframe.memory_usage().sum()
+        if len(self.buffer) >= self.flush_every or \
+                self.nbytes >= self.max_bytes or \
+                time.monotonic() - self.started >= self.max_seconds:
+            self.flush()
+
+    def flush(self):
+        """ write the buffered soundings """
+        if not self.buffer:
+            return
+        soundings = self.buffer
+        self.buffer = list()
+        self.nbytes = 0
+        self._write(soundings)
+
+    def _write(self, soundings):
+        raise NotImplementedError
+
+    def _close(self):
+        pass
+
+    def close(self):
+        try:
+            self.flush()
+        finally:
+            self._close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+class TableHDF(WriteBuffer):
+    """
+    Table layout of download_wyoming: one pytables node per sounding,
+    keyed like Y20010101Z00, put in bulk by WriteBuffer
+
+    The nodes are written without a pytables index (useless on a
+    single sounding, and most of the cost of a put), and the file
+    is flushed to disk once per buffer.
+
+    Parameters
+    ----------
+
+    out_name : str
+               hdf file
+
+    mode : str
+           'w' truncates out_name, 'a' adds to (and replaces
+           soundings in) an existing file
+
+    flush_every, max_bytes, max_seconds :
+           buffer limits (see WriteBuffer)
+    """
+
+    def __init__(self, out_name, mode='a', flush_every=100, **limits):
+        WriteBuffer.__init__(self, flush_every, **limits)
+        self.store = pd.HDFStore(out_name, mode)
+
+    def _write(self, soundings):
+        for thetime, dataframe in soundings:
+            self.store.put(thetime.strftime("Y%Y%m%dZ%H"), dataframe,
+                           format='table', index=False)
+        self.store.flush(fsync=True)
+
+    def _close(self):
+        self.store.close()
+
+
+class DenseHDF(WriteBuffer):
+    """
+    Dense hdf layout: one chunked, compressed (time, level) dataset
+    per sounding column, NaN-padded, with the launch times in
+    ``time`` (seconds since 1970) and the level count of each
+    sounding in ``nlevels``
+
+    Reading a year is then a few contiguous chunk reads instead of
+    a walk over one table node per sounding (see read_dense).
+    Soundings are buffered (see WriteBuffer) and new ones written
+    as one block; a sounding whose time is already stored replaces
+    it.
+
+    Parameters
+    ----------
+
+    filename : str
+               hdf file
+
+    mode : str
+           'a' adds to an existing dense file, 'w' starts a new one
+
+    chunk_times, chunk_levels : int
+                                chunk shape of the 2-D datasets
+
+    compression : str
+                  h5py compression filter ('gzip', 'lzf' or None)
+
+    flush_every, max_bytes, max_seconds :
+           buffer limits (see WriteBuffer)
+    """
+
+    def __init__(self, filename, mode='a', chunk_times=128,
+                 chunk_levels=128, compression='gzip', flush_every=100,
+                 **limits):
+        WriteBuffer.__init__(self, flush_every, **limits)
+        self.filename = filename
+        if mode == 'a' and os.path.exists(filename):
+            self.f = h5py.File(filename, 'a')
+            if self.f.attrs.get('layout') != 'dense':
+                self.f.close()
+                raise ValueError('{} is not a dense hdf file'.format(filename))
+        else:
+            f = h5py.File(filename, 'w')
+            f.attrs['layout'] = 'dense'
+            var_time = f.create_dataset('time', shape=(0,), maxshape=(None,),
+                                        dtype=np.int64,
+                                        chunks=(chunk_times,))
+            var_time.attrs['units'] = 'seconds since 1970-01-01 00:00:00'
+            f.create_dataset('nlevels', shape=(0,), maxshape=(None,),
+                             dtype=np.int32, chunks=(chunk_times,))
+            for name in sounding_columns:
+                f.create_dataset(name, shape=(0, 0), maxshape=(None, None),
+                                 dtype=np.float32,
+                                 chunks=(chunk_times, chunk_levels),
+                                 compression=compression, shuffle=True,
+                                 fillvalue=np.nan)
+            self.f = f
+        self.rows = {stamp: n for n, stamp in
+                     enumerate(self.f['time'][:].tolist())}
+
+    def _write(self, soundings):
+        """ write new soundings as one block, replace stored ones """
+        f = self.f
+        latest = {thetime.value // 10**9: df for thetime, df in soundings}
+        start = len(self.rows)
+        new = [stamp for stamp in latest if stamp not in self.rows]
+        for n, stamp in enumerate(new):
+            self.rows[stamp] = start + n
+        nrows = start + len(new)
+        nlev = max([len(df) for df in latest.values()] +
+                   [f['pres'].shape[1]])
+
+        f['time'].resize((nrows,))
+        f['nlevels'].resize((nrows,))
+        f['time'][start:] = new
+        f['nlevels'][start:] = [len(latest[stamp]) for stamp in new]
+        for name in sounding_columns:
+            f[name].resize((nrows, nlev))
+            if new:
+                block = np.full((len(new), nlev), np.nan, dtype=np.float32)
+                for n, stamp in enumerate(new):
+                    values = latest[stamp][name].values
+                    block[n, :len(values)] = values
+                f[name][start:nrows, :] = block
+        for stamp, df in latest.items():
+            row = self.rows[stamp]
+            if row >= start:
+                continue
+            f['nlevels'][row] = len(df)
+            for name in sounding_columns:
+                values = np.full(nlev, np.nan, dtype=np.float32)
+                values[:len(df)] = df[name].values
+                f[name][row, :] = values
+        f.flush()
+
+    def _close(self):
+        self.f.close()
+
+
+def read_dense(filename, start=None, stop=None):
+    """
+    Read soundings of a dense hdf file (DenseHDF) between the times
+    start and stop (inclusive, None for open ends)
+
+    Returns an xarray Dataset with the sounding columns on
+    (time, level) and nlevels on time, sorted by time
+    """
+    with h5py.File(filename, 'r') as f:
+        times = pd.to_datetime(f['time'][:], unit='s')
+        keep = np.ones(len(times), dtype=bool)
+        if start is not None:
+            keep &= times >= pd.Timestamp(start)
+        if stop is not None:
+            keep &= times <= pd.Timestamp(stop)
+        rows = np.flatnonzero(keep)
+        if len(rows) == 0:
+            first, last = 0, 0
+        else:
+            first, last = rows[0], rows[-1] + 1
+        select = keep[first:last]
+        data = {name: (('time', 'level'), f[name][first:last][select])
+                for name in sounding_columns}
+        data['nlevels'] = (('time',), f['nlevels'][first:last][select])
+        attrs = {key: f.attrs[key] for key in f.attrs.keys()}
+    ds = xr.Dataset(data, coords=dict(time=times[first:last][select]),
+                    attrs=attrs)
+    return ds.sortby('time')
+
+
+def calendar_row(thetime, first_year, month_rows=62):
+    """
+    Row of thetime on the calendar grid of ZarrStore: month_rows
+    rows per month starting in January of first_year, two per day
+    """
+    month = (thetime.year - first_year) * 12 + thetime.month - 1
+    return month * month_rows + 2 * (thetime.day - 1) + thetime.hour // 12
+
+
+# sounding indices stored by ZarrStore
+zarr_indices = [name for name in index_names.values()
+                if name not in text_indices]
+
+
+class ZarrStore(WriteBuffer):
+    """
+    Zarr directory store of the soundings of one station, on a
+    fixed calendar grid of (time, level) arrays, one per column
+
+    Every month owns ``month_rows`` (62) time rows, one per day and
+    launch (00Z, 12Z), and a time chunk is exactly one month. The
+    row of a sounding thus only depends on its time, the arrays
+    never need resizing, and workers writing different months or
+    years (or different stations, which live in different stores)
+    never touch the same chunk: they can write in parallel from
+    separate processes or hosts. Rows of days that do not exist or
+    were not written keep nlevels 0 and NaN data; empty chunks take
+    no space on disk. The sounding indices (see parse_indices) live
+    on the same grid, one array per numeric index in the ``indices``
+    group, so parallel writers never share a file for them either.
+
+    Create the store once (e.g. ZarrStore(path) in the parent job)
+    before starting parallel writers; concurrent creation is safe
+    but wasteful.
+
+    Parameters
+    ----------
+
+    path : str
+           store directory, opened for writing if it exists
+
+    first_year, last_year : int
+                            span of the time grid of a new store
+
+    max_levels : int
+                 size of the level dimension; longer soundings
+                 raise ValueError
+
+    chunk_levels : int
+                   level size of the chunks
+
+    flush_every, max_bytes, max_seconds :
+           buffer limits (see WriteBuffer)
+    """
+
+    month_rows = 62
+
+    def __init__(self, path, first_year=1970, last_year=2099,
+                 max_levels=4096, chunk_levels=128, flush_every=100,
+                 **limits):
+        import zarr
+
+        WriteBuffer.__init__(self, flush_every, **limits)
+        self.path = path
+        if not os.path.exists(path):
+            self._create(first_year, last_year, max_levels, chunk_levels)
+        self.group = zarr.open_group(path, mode='r+')
+        self.first_year = self.group.attrs['first_year']
+        self.nrows = self.group['nlevels'].shape[0]
+        self.max_levels = self.group['pres'].shape[1]
+        self.indices = dict()
+        if 'indices' not in self.group:
+            # store written before it held the indices
+            self._create_indices(self.group)
+
+    def _create(self, first_year, last_year, max_levels, chunk_levels):
+        import zarr
+
+        nrows = (last_year - first_year + 1) * 12 * self.month_rows
+        tmp = '{}.{}.{}.tmp'.format(self.path, os.getpid(),
+                                    threading.get_ident())
+        group = zarr.open_group(tmp, mode='w')
+        group.attrs.update(dict(layout='calendar', first_year=first_year,
+                                month_rows=self.month_rows,
+                                history='written by wyominglib.py'))
+        group.create_array('time', shape=(nrows,),
+                           chunks=(self.month_rows,), dtype=np.int64,
+                           fill_value=0,
+                           attributes=dict(units='seconds since '
+                                                 '1970-01-01 00:00:00'))
+        group.create_array('nlevels', shape=(nrows,),
+                           chunks=(self.month_rows,), dtype=np.int32,
+                           fill_value=0)
+        for name in ['hmin', 'hmax']:
+            group.create_array(name, shape=(nrows,),
+                               chunks=(self.month_rows,), dtype=np.float32,
+                               fill_value=np.nan)
+        for name in sounding_columns:
+            group.create_array(name, shape=(nrows, max_levels),
+                               chunks=(self.month_rows, chunk_levels),
+                               dtype=np.float32, fill_value=np.nan,
+                               attributes=dict(
+                                   long_name=column_long_names[name]))
+        self._create_indices(group)
+        try:
+            os.rename(tmp, self.path)
+        except OSError:
+            # another writer created the store first
+            import shutil
+            shutil.rmtree(tmp)
+
+    def _create_indices(self, group):
+        """ indices group, one float64 array per numeric index """
+        from zarr.errors import ContainsArrayError, ContainsGroupError
+
+        nrows = group['nlevels'].shape[0]
+        try:
+            group.create_group('indices')
+        except ContainsGroupError:
+            pass
+        for name in zarr_indices:
+            attributes = dict()
+            if name == 'time':
+                attributes = dict(units='seconds since 1970-01-01 00:00:00')
+            try:
+                group['indices'].create_array(
+                    name, shape=(nrows,), chunks=(self.month_rows,),
+                    dtype=np.float64, fill_value=np.nan,
+                    attributes=attributes)
+            except ContainsArrayError:
+                # another writer added it first
+                pass
+
+    def row(self, thetime):
+        """ time row of a 00Z or 12Z launch """
+        thetime = pd.Timestamp(thetime)
+        if thetime.hour not in (0, 12) or thetime.minute:
+            raise ValueError('{} is not a 00Z or 12Z launch'.format(thetime))
+        row = calendar_row(thetime, self.first_year)
+        if not 0 <= row < self.nrows:
+            raise ValueError('{} is outside the time span of {}'
+                             .format(thetime, self.path))
+        return row
+
+    def append(self, thetime, dataframe, indices=None):
+        """
+        queue one sounding, with its indices (from parse_indices)
+        if given; written on the next flush
+        """
+        if len(dataframe) > self.max_levels:
+            raise ValueError('{} levels at {}, store holds {}'.format(
+                len(dataframe), thetime, self.max_levels))
+        self.row(thetime)
+        self.indices[pd.Timestamp(thetime)] = indices or dict()
+        WriteBuffer.append(self, thetime, dataframe)
+
+    def _write(self, soundings):
+        """ one write per array """
+        latest = {self.row(thetime): (thetime, df)
+                  for thetime, df in soundings}
+        rows = sorted(latest)
+        group = self.group
+        # a shorter sounding replacing a stored one must clear the
+        # levels the old one used
+        old = group['nlevels'].oindex[rows]
+        nlev = max(max(len(df) for _, df in latest.values()),
+                   int(old.max()))
+        group['time'].oindex[rows] = [
+            latest[row][0].value // 10**9 for row in rows]
+        group['nlevels'].oindex[rows] = [len(latest[row][1]) for row in rows]
+        hmin, hmax = zip(*[height_range(latest[row][1]['hght'].values)
+                           for row in rows])
+        group['hmin'].oindex[rows] = hmin
+        group['hmax'].oindex[rows] = hmax
+        for name in sounding_columns:
+            block = np.full((len(rows), nlev), np.nan, dtype=np.float32)
+            for n, row in enumerate(rows):
+                values = latest[row][1][name].values
+                block[n, :len(values)] = values
+            group[name].oindex[rows, :nlev] = block
+        indices = [self.indices.pop(latest[row][0], dict()) for row in rows]
+        for name in zarr_indices:
+            values = [index.get(name, np.nan) for index in indices]
+            if name == 'time':
+                values = [np.nan if pd.isnull(value) else
+                          value.value / 10**9 for value in values]
+            group['indices'][name].oindex[rows] = values
+
+    def set_attrs(self, attr_dict):
+        """ station attributes (from make_frames) as store attributes """
+        self.group.attrs.update(
+            {key: attr_dict[key] for key in
+             ['site_id', 'longitude', 'latitude', 'elevation', 'units']
+             if key in attr_dict})
+
+
+def zarr_times(path):
+    """ sounding times (pd.DatetimeIndex) held by a ZarrStore """
+    import zarr
+
+    group = zarr.open_group(path, mode='r')
+    nlevels = group['nlevels'][:]
+    rows = np.flatnonzero(nlevels > 0)
+    return pd.to_datetime(group['time'].oindex[rows], unit='s')
+
+
+def read_zarr(path, start=None, stop=None):
+    """
+    Read soundings of a ZarrStore between the times start and
+    stop (inclusive, None for open ends)
+
+    Only the month chunks of the range are read. Returns an
+    xarray Dataset like read_dense, with the times that hold a
+    sounding and the levels trimmed to the longest one.
+    """
+    import zarr
+
+    group = zarr.open_group(path, mode='r')
+    first_year = group.attrs['first_year']
+    nrows = group['nlevels'].shape[0]
+    first, last = 0, nrows
+    if start is not None:
+        first = calendar_row(pd.Timestamp(start), first_year)
+    if stop is not None:
+        last = calendar_row(pd.Timestamp(stop), first_year) + 1
+    first, last = min(max(first, 0), nrows), min(max(last, 0), nrows)
+    nlevels = group['nlevels'][first:last]
+    times = pd.to_datetime(group['time'][first:last], unit='s')
+    keep = nlevels > 0
+    if start is not None:
+        keep &= times >= pd.Timestamp(start)
+    if stop is not None:
+        keep &= times <= pd.Timestamp(stop)
+    rows = first + np.flatnonzero(keep)
+    nlev = int(nlevels[keep].max()) if keep.any() else 0
+    data = {name: (('time', 'level'),
+                   group[name].oindex[rows, :nlev])
+            for name in sounding_columns}
+    data['nlevels'] = (('time',), nlevels[keep])
+    return xr.Dataset(data, coords=dict(time=times[keep]),
+                      attrs=dict(group.attrs))
+
+
+def read_zarr_indices(path):
+    """
+    Sounding indices of a ZarrStore, as a table like read_indices:
+    one row per sounding, indexed by launch time, the station
+    number in stnm
+    """
+    import zarr
+
+    group = zarr.open_group(path, mode='r')
+    rows = np.flatnonzero(group['nlevels'][:] > 0)
+    times = pd.to_datetime(group['time'].oindex[rows], unit='s')
+    frame = pd.DataFrame({name: group['indices'][name].oindex[rows]
+                          for name in zarr_indices},
+                         index=pd.DatetimeIndex(times, name='launch'))
+    frame['time'] = pd.to_datetime(frame['time'], unit='s')
+    frame.insert(0, 'stnm', str(group.attrs.get('site_id', '')))
+    return frame
+
+
+def zarr_name(out_directory, region, st_name):
+    """ ZarrStore of a station in out_directory """
+    return '{}/wyoming_{}_{}.zarr'.format(out_directory, region, st_name)
+
+
+def write_zarr(out_name, soundings, flush_every=100):
+    """
+    Write parsed soundings (date, attr_dict, sounding_df, resp) to
+    the ZarrStore out_name, creating it if needed; soundings
+    without data are left out, and the sounding indices are stored
+    with each sounding
+    """
+    attr_dict = dict()
+    with ZarrStore(out_name, flush_every=flush_every) as store:
+        for date, at_dict, sounding_df, resp in soundings:
+
+            print_sounding(date, resp)
+
+            if resp == 'OK':
+                store.append(date, sounding_df, at_dict['indices'])
+                attr_dict = at_dict
+        if attr_dict:
+            store.set_attrs(attr_dict)
+    print('zarr store {} written'.format(out_name))
+
+
+class ParquetArchive(WriteBuffer):
+    """
+    Parquet dataset of the soundings of one station, partitioned
+    by year, with one row per (time, level)
+
+    out_name is the station partition (``.../station=<name>``) of a
+    dataset root holding every station (see parquet_name), so the
+    root reads as one table with station and year columns. Rows are
+    sorted by time and level and carry typed columns (time as a
+    timestamp, level int16, month int8, the sounding columns
+    float32), so scans filtered on station, year, month, time or
+    pressure skip whole files and row groups (see read_parquet).
+
+    Every month lives in one file, year=<YYYY>/part-<YYYYMM>.parquet.
+    A flush of the buffer (see WriteBuffer) rewrites the files of
+    the months it holds, merged with the soundings already stored
+    there, new ones winning on equal times: downloading soundings
+    again replaces them instead of adding duplicate rows.
+
+    Parameters
+    ----------
+
+    out_name : str
+               station partition directory
+
+    row_group_size : int
+                     rows per parquet row group
+
+    flush_every, max_bytes, max_seconds :
+           buffer limits (see WriteBuffer)
+    """
+
+    def __init__(self, out_name, row_group_size=16384, flush_every=1000,
+                 **limits):
+        WriteBuffer.__init__(self, flush_every, **limits)
+        self.out_name = out_name
+        self.row_group_size = row_group_size
+        self.units = ''
+
+    def set_attrs(self, attr_dict):
+        self.units = attr_dict.get('units', self.units)
+
+    def table(self, soundings):
+        """ pyarrow Table of (time, dataframe) soundings """
+        import pyarrow as pa
+
+        sizes = np.array([len(df) for _, df in soundings])
+        times = np.repeat(np.array([t.value // 10**9 for t, _ in soundings]),
+                          sizes)
+        months = np.repeat(np.array([t.month for t, _ in soundings]), sizes)
+        columns = dict(
+            month=pa.array(months, pa.int8()),
+            time=pa.array(times, pa.timestamp('s')),
+            level=pa.array(np.concatenate([np.arange(n) for n in sizes]),
+                           pa.int16()))
+        for name in sounding_columns:
+            values = np.concatenate([df[name].values for _, df in soundings])
+            columns[name] = pa.array(values.astype(np.float32), pa.float32())
+        metadata = dict(units=self.units, history='written by wyominglib.py')
+        return pa.table(columns, metadata=metadata)
+
+    def month_file(self, year, month):
+        """ file of the soundings of a month """
+        return os.path.join(self.out_name, 'year={}'.format(year),
+                            'part-{}{:02d}.parquet'.format(year, month))
+
+    def _write(self, soundings):
+        """ one file per month """
+        import pyarrow as pa
+        import pyarrow.compute as pc
+        import pyarrow.parquet as pq
+
+        latest = dict(soundings)
+        soundings = [(t, latest[t]) for t in sorted(latest)]
+        for (year, month), group in itertools.groupby(
+                soundings, key=lambda s: (s[0].year, s[0].month)):
+            table = self.table(list(group))
+            filename = self.month_file(year, month)
+            if os.path.exists(filename):
+                old = pq.read_table(filename)
+                old = old.filter(pc.invert(pc.is_in(
+                    old['time'], value_set=table['time'])))
+                table = pa.concat_tables([old.cast(table.schema), table])
+                table = table.sort_by([('time', 'ascending'),
+                                       ('level', 'ascending')])
+            os.makedirs(os.path.dirname(filename), exist_ok=True)
+            # readers never see a half written month, nor (with the
+            # leading dot) the temporary file
+            tmp = os.path.join(os.path.dirname(filename), '.{}.{}.tmp'.format(
+                os.path.basename(filename), os.getpid()))
+            pq.write_table(table, tmp, row_group_size=self.row_group_size)
+            os.replace(tmp, filename)
+
+
+def parquet_name(out_directory, region, st_name):
+    """ station partition of the parquet dataset of a region """
+    return '{}/wyoming_{}.parquet/station={}'.format(out_directory,
+                                                     region, st_name)
+
+
+def parquet_times(out_name):
+    """ sounding times (pd.DatetimeIndex) held by a ParquetArchive """
+    import pyarrow.parquet as pq
+
+    times = pq.read_table(out_name, columns=['time'])['time']
+    return pd.DatetimeIndex(np.unique(times.to_numpy()))
+
+
+def read_parquet(root, columns=None, filters=None):
+    """
+    Read a parquet dataset written by download_wyoming with
+    layout='parquet' (a region root or one station partition)
+
+    Only the requested columns are read, files and row groups
+    ruled out by filters are skipped, and the files are memory
+    mapped: the result is a pyarrow Table (``.to_pandas()`` for a
+    DataFrame).
+
+    Example
+
+    read_parquet('/home/raul/wyoming_samer.parquet',
+                 columns=['station', 'time', 'pres', 'temp'],
+                 filters=[('station', '=', 'puerto_montt'),
+                          ('month', 'in', [6, 7, 8]),
+                          ('pres', '>=', 500.)])
+    """
+    import pyarrow.parquet as pq
+
+    return pq.read_table(root, columns=columns, filters=filters,
+                         memory_map=True)
+
+
+def write_parquet(out_name, soundings, flush_every=1000):
+    """
+    Write parsed soundings (date, attr_dict, sounding_df, resp) to
+    the ParquetArchive out_name, replacing the soundings it holds
+    for the same times; soundings without data are left out and
+    the sounding indices are merged into the table inside the
+    partition (see write_indices)
+    """
+    entries = list()
+    rows = list()
+    attr_dict = dict()
+    try:
+        with ParquetArchive(out_name, flush_every=flush_every) as archive:
+            for date, at_dict, sounding_df, resp in soundings:
+
+                print_sounding(date, resp)
+
+                node = 'year={}'.format(date.year)
+                if resp == 'OK':
+                    archive.append(date, sounding_df)
+                    archive.set_attrs(at_dict)
+                    attr_dict = at_dict
+                    rows.append((date, at_dict['indices']))
+                    entries.append((date, sounding_df, node, -1))
+                else:
+                    entries.append((date, None, node, -1))
+    finally:
+        if os.path.isdir(out_name):
+            write_catalog(out_name, catalog_frame(
+                entries, attr_dict.get('site_id', '')), 'a')
+            write_indices(out_name, rows, mode='a')
+    print('parquet dataset {} written'.format(out_name))
+
+
+def write_hdf(out_name, soundings, mode='w', layout='table', flush_every=100):
+    """
+    Write parsed soundings to an hdf file
+
+    This is the single writer stage of the download: it consumes
+    the output of parse_soundings in order. The sounding indices
+    go to a table next to the file (see write_indices), the list of
+    soundings written to the archive catalog (see write_catalog),
+    and the soundings are also appended to one NetCDF file per
+    archive (see RaggedNetCDF and netcdf_name).
+
+    Parameters
+    ----------
+
+    out_name : str
+               output hdf file
+
+    soundings : iterable
+                (date, attr_dict, sounding_df, resp) tuples
+
+    mode : str
+           'w' truncates out_name, 'a' adds to (and replaces
+           soundings in) an existing file
+
+    layout : str
+             'table' stores one pytables node per sounding (keys
+             like Y20010101Z00); 'dense' stores (time, level)
+             datasets per column with DenseHDF, soundings without
+             data being left out
+
+    flush_every : int
+                  soundings buffered before each bulk write (see
+                  WriteBuffer); soundings already parsed are written
+                  even if the download fails
+    """
+    attr_dict = dict()
+    rows = list()
+    written = list()
+
+    if layout == 'dense':
+        store = DenseHDF(out_name, mode, flush_every=flush_every)
+    else:
+        store = TableHDF(out_name, mode, flush_every=flush_every)
+
+    # start downloading for each date
+    try:
+        with store, RaggedNetCDF(netcdf_name(out_name), mode,
+                                 flush_every=flush_every) as nc:
+
+            for date, at_dict, sounding_df, resp in soundings:
+
+                if resp == 'OK':
+                    attr_dict = at_dict
+                    rows.append((date, at_dict['indices']))
+
+                print_sounding(date, resp)
+
+                if resp == 'OK':
+                    nc.append(date, sounding_df, at_dict)
+                if resp == 'OK' or layout != 'dense':
+                    store.append(date, sounding_df)
+                written.append((date, sounding_df if resp == 'OK' else None))
+    finally:
+        # the buffers are flushed on the way out, so the catalog
+        # lists what reached the file even after a failure
+        entries = list()
+        for date, sounding_df in written:
+            if layout == 'dense':
+                row = store.rows.get(date.value // 10**9, -1)
+                entries.append((date, sounding_df, '', row))
+            else:
+                entries.append((date, sounding_df,
+                                date.strftime('Y%Y%m%dZ%H'), -1))
+        write_catalog(out_name, catalog_frame(
+            entries, attr_dict.get('site_id', '')), mode=mode)
+        write_indices(out_name, rows, mode=mode)
+
+    write_attrs(out_name, attr_dict)
+
+
+def write_attrs(out_name, attr_dict):
+    """
+    Write the station attributes of attr_dict (from make_frames)
+    as hdf file attributes of out_name
+    """
+    attr_dict = dict(attr_dict)
+    attr_dict['history'] = "written by wyominglib.py"
+    key_list = ['header', 'site_id', 'longitude', 'latitude',
+                'elevation', 'units', 'history']
+
+    with h5py.File(out_name, 'a') as f:
+        print('Writing HDF5 file attributes')
+        for key in key_list:
+            try:
+                print('writing key, value: ', key, attr_dict[key])
+                f.attrs[key] = attr_dict[key]
+            except KeyError:
+                pass
+        f.close()
+
+    print('hdf file {} written'.format(out_name))
+    print('reading attributes: ')
+    with h5py.File(out_name, 'r') as f:
+        keys = f.attrs.keys()
+        for key in keys:
+            try:
+                print(key, f.attrs[key])
+            except OSError:
+                pass
+
+
+def archive_name(layout, out_directory, region='{0}', st_name='{1}',
+                 dstr='{2}'):
+    """
+    Archive of a station download for layout (see download_wyoming):
+    an hdf file per station and dates, or the station ZarrStore or
+    parquet partition, which hold every date. With the defaults the
+    result is the name_template of station_dates.
+    """
+    if layout == 'zarr':
+        return zarr_name(out_directory, region, st_name)
+    if layout == 'parquet':
+        return parquet_name(out_directory, region, st_name)
+    return '{}/wyoming_{}_{}_{}.h5'.format(out_directory, region,
+                                           st_name, dstr)
+
+
+def write_archive(layout, out_name, soundings, mode='w', flush_every=100):
+    """
+    Writer stage of a download: parsed soundings (date, attr_dict,
+    sounding_df, resp) go to write_zarr, write_parquet or write_hdf
+    according to layout; mode only applies to hdf files
+    """
+    if layout == 'zarr':
+        write_zarr(out_name, soundings, flush_every=flush_every)
+    elif layout == 'parquet':
+        write_parquet(out_name, soundings, flush_every=flush_every)
+    else:
+        write_hdf(out_name, soundings, mode=mode, layout=layout,
+                  flush_every=flush_every)
+
+
+def download_wyoming(region=None, station=None, year=None,
+                     date=None, dates=None, out_directory=None,
+                     session=None, batch=None, workers=1,
+                     missing=None, sync=False, queue_size=8,
+                     stream=False, errors=None, layout='table',
+                     flush_every=100):
+    """
+    function to test downloading a sounding
+    from http://weather.uwyo.edu/cgi-bin/sounding and
+    creating an hdf file with soundings and attributes
+
+    see the notebook newsoundings.ipynb for use
+
+    session : WyomingSession, optional
+              pooled HTTP session shared across calls;
+              defaults to the module-wide session
+
+    batch : None, 'month' or int
+            request a whole month (or ``batch`` days) per HTTP
+            call instead of one request per date
+
+    workers : int
+              number of requests kept in flight
+
+    missing : wyoming_cache.MissingCache, optional
+              persistent record of 'NO SOUNDING' dates, which are
+              skipped without a request
+
+    sync : bool
+           if True and the hdf file exists, only download the
+           soundings it is missing (or still holds as 'NO SOUNDING')
+           and add them to the file instead of rewriting it;
+           future launches are skipped
+
+    queue_size : int
+                 fetch, parse and write run as overlapping stages
+                 connected by queues of this size; 0 runs them
+                 one after another
+
+    stream : bool
+             with batch and workers=1, parse each window page
+             while it downloads (see fetch_soundings)
+
+    errors : ErrorReport, optional
+             soundings that fail to parse are recorded here and
+             the download carries on; without it a malformed
+             sounding raises ParseError
+
+    layout : str
+             'table' (one node per sounding), 'dense' (chunked
+             (time, level) datasets, see DenseHDF) or 'zarr'
+             (soundings added to the station ZarrStore
+             wyoming_<region>_<name>.zarr, which several jobs can
+             write in parallel for different months or years) or
+             'parquet' (one row per (time, level) in the station
+             partition of wyoming_<region>.parquet, see
+             ParquetArchive)
+
+    flush_every : int
+                  soundings buffered before each bulk write (see
+                  WriteBuffer)
+    """
+
+    st_num = station['number']
+    st_name = station['name']
+
+    name_template = archive_name(layout, out_directory)
+    dates, out_name = station_dates(region, st_name, year=year,
+                                    date=date, dates=dates,
+                                    name_template=name_template)
+
+    mode = 'w'
+    if sync:
+        dates, mode = sync_dates(out_name, dates)
+        print('sync {}: {} soundings to download'.format(out_name,
+                                                          len(dates)))
+        if len(dates) == 0:
+            return
+
+    soundings = fetch_soundings(region, st_num, dates,
+                                session=session, batch=batch,
+                                workers=workers, missing=missing,
+                                stream=stream)
+    parsed = pipeline(soundings, queue_size, errors)
+    write_archive(layout, out_name, parsed, mode=mode,
+                  flush_every=flush_every)
+
+
+def download_stations(region=None, stations=None, year=None,
+                      date=None, dates=None, out_directory=None,
+                      session=None, batch=None, workers=8,
+                      missing=None, sync=False, queue_size=8,
+                      errors=None, layout='table', flush_every=100):
+    """
+    Download several stations into one hdf file per station
+
+    Requests for all stations share one thread pool, so ``workers``
+    downloads stay in flight across station boundaries, while a
+    single writer (write_hdf) stores the soundings in order.
+    Politeness towards the server is set with the rate limit of
+    the session, e.g. WyomingSession(rate=2., maxsize=8); give the
+    session at least ``workers`` connections per host.
+
+    Parameters
+    ----------
+
+    stations : list
+               station dicts with 'name' and 'number' keys
+
+    other parameters as in download_wyoming
+
+    Returns
+    -------
+
+    written : list
+              names of the hdf files (or zarr stores, parquet
+              partitions) written
+    """
+    if session is None:
+        session = get_session()
+
+    name_template = archive_name(layout, out_directory)
+
+    jobs = list()
+    modes = dict()
+    for station in stations:
+        st_dates, out_name = station_dates(region, station['name'],
+                                           year=year, date=date,
+                                           dates=dates,
+                                           name_template=name_template)
+        modes[out_name] = 'w'
+        if sync:
+            st_dates, modes[out_name] = sync_dates(out_name, st_dates)
+        skip = set()
+        if missing is not None:
+            skip = missing.skip(region, station['number'], st_dates)
+        jobs.extend((out_name, job) for job in
+                    make_jobs(region, station['number'], st_dates,
+                              batch=batch, skip=skip))
+
+    def run(item):
+        out_name, job = item
+        return out_name, run_job(session, job, missing)
+
+    written = list()
+    results = imap_bounded(run, jobs, workers)
+    try:
+        for out_name, group in itertools.groupby(results,
+                                                 key=lambda r: r[0]):
+            soundings = (pair for _, pairs in group for pair in pairs)
+            parsed = pipeline(soundings, queue_size, errors)
+            write_archive(layout, out_name, parsed, mode=modes[out_name],
+                          flush_every=flush_every)
+            written.append(out_name)
+    finally:
+        if missing is not None:
+            missing.flush()
+
+    return written
+
+
+def page_files(paths):
+    """
+    Return the raw page files in paths: files are kept as given,
+    directories (e.g. a ResponseCache) are searched for *.html
+    """
+    files = list()
+    for path in paths:
+        if os.path.isdir(path):
+            files.extend(sorted(glob(os.path.join(path, '**', '*.html'),
+                                     recursive=True)))
+        else:
+            files.append(path)
+    return files
+
+
+def parse_page_file(filename):
+    """
+    Worker of reingest: parse every sounding of a raw page file
+
+    Returns the (time, attr_dict, df) tuples of iter_frames and
+    the ErrorReport records of the soundings that failed
+    """
+    with open(filename, 'rb') as f:
+        html_doc = f.read()
+    errors = ErrorReport()
+    frames = list(iter_frames(html_doc, errors=errors))
+    for record in errors.records:
+        record['file'] = filename
+    return frames, errors.records
+
+
+def reingest(paths, out_directory, region='samer', names=None,
+             workers=None, chunksize=16, max_open=32, errors=None):
+    """
+    Re-parse cached raw pages into hdf files, one per station-year
+
+    Pages are parsed on a process pool (``chunksize`` pages are sent
+    to a worker at a time) and a single writer in this process puts
+    every sounding into wyoming_<region>_<name>_<year>.h5, replacing
+    soundings already there. Pages describe themselves, so the
+    station and times are taken from their content. The sounding
+    indices and the catalog entries are merged into the tables
+    next to each file (see write_indices and write_catalog).
+
+    Parameters
+    ----------
+
+    paths : list
+            page files or directories holding them (e.g. the
+            directory of a wyoming_cache.ResponseCache)
+
+    out_directory : str
+                    where the hdf files are written
+
+    region : str
+             region used in the file names
+
+    names : dict, optional
+            station number -> station name used in the file names;
+            defaults to the station number
+
+    workers : int, optional
+              number of parsing processes (default: cpu count)
+
+    chunksize : int
+                pages handed to a worker at a time
+
+    max_open : int
+               hdf files kept open at once by the writer
+
+    errors : ErrorReport, optional
+             collects the soundings that failed to parse
+
+    Returns
+    -------
+
+    written : list
+              names of the hdf files written
+    """
+    from concurrent.futures import ProcessPoolExecutor
+
+    if names is None:
+        names = dict()
+    name_template = archive_name('table', out_directory)
+
+    stores = collections.OrderedDict()
+    attrs = dict()
+    rows = dict()
+    entries = dict()
+    files = page_files(paths)
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        try:
+            for frames, records in pool.map(parse_page_file, files,
+                                            chunksize=chunksize):
+                if errors is not None:
+                    errors.records.extend(records)
+                for thetime, attr_dict, df in frames:
+                    if thetime is None:
+                        continue
+                    site_id = attr_dict['site_id']
+                    out_name = name_template.format(
+                        region, names.get(site_id, site_id), thetime.year)
+                    if out_name in stores:
+                        stores.move_to_end(out_name)
+                    else:
+                        if len(stores) >= max_open:
+                            stores.popitem(last=False)[1].close()
+                        stores[out_name] = TableHDF(out_name, 'a')
+                    stores[out_name].append(thetime, df)
+                    entries.setdefault(out_name, list()).append(
+                        (thetime, df, thetime.strftime('Y%Y%m%dZ%H'), -1))
+                    attrs[out_name] = attr_dict
+                    rows.setdefault(out_name, list()).append(
+                        (thetime, attr_dict['indices']))
+        finally:
+            for store in stores.values():
+                store.close()
+            # the stores are flushed, so the catalogs list what
+            # reached the files even after a failure
+            for out_name, attr_dict in attrs.items():
+                write_catalog(out_name,
+                              catalog_frame(entries[out_name],
+                                            attr_dict['site_id']),
+                              mode='a')
+                write_indices(out_name, rows[out_name], mode='a')
+                write_attrs(out_name, attr_dict)
+    return sorted(attrs)
+
+
+column_long_names = dict(pres='pressure',
+                         hght='geopotential height',
+                         temp='temperature',
+                         dwpt='dew point temperature',
+                         relh='relative humidity',
+                         mixr='mixing ratio',
+                         drct='wind direction',
+                         sknt='wind speed',
+                         thta='potential temperature',
+                         thte='equivalent potential temperature',
+                         thtv='virtual potential temperature')
+
+
+class RaggedNetCDF(WriteBuffer):
+    """
+    One NetCDF4 file holding every sounding of a station, as a CF
+    contiguous ragged array
+
+    The levels of all soundings are stored one after another along
+    the unlimited ``obs`` dimension, and ``row_size`` (along the
+    unlimited ``time`` dimension) gives the number of levels of each
+    sounding, so soundings are appended in place whatever their
+    level count. xarray/cf tools read a profile as
+    obs[sum(row_size[:i]):sum(row_size[:i+1])]. Soundings are
+    buffered (see WriteBuffer) and each buffer written as one slice
+    of every variable.
+
+    Parameters
+    ----------
+
+    filename : str
+               NetCDF file; appended to if it exists and mode is 'a'
+
+    mode : str
+           'a' appends to an existing file, 'w' starts a new one
+
+    flush_every, max_bytes, max_seconds :
+           buffer limits (see WriteBuffer)
+    """
+
+    time_units = "seconds since 1970-01-01 00:00:00"
+
+    def __init__(self, filename, mode='a', flush_every=100, **limits):
+        from netCDF4 import Dataset
+
+        WriteBuffer.__init__(self, flush_every, **limits)
+        self.filename = filename
+        if mode == 'a' and os.path.exists(filename):
+            self.nc = Dataset(filename, 'a')
+        else:
+            self.nc = Dataset(filename, 'w', format='NETCDF4')
+            self.nc.createDimension('time', None)
+            self.nc.createDimension('obs', None)
+            var_time = self.nc.createVariable('time', np.float64, ('time',))
+            var_time.standard_name = 'time'
+            var_time.units = self.time_units
+            var_time.calendar = 'standard'
+            var_time.axis = 'T'
+            row_size = self.nc.createVariable('row_size', np.int32,
+                                              ('time',))
+            row_size.long_name = 'number of levels of each sounding'
+            row_size.sample_dimension = 'obs'
+            self.nc.Conventions = 'CF-1.8'
+            self.nc.featureType = 'profile'
+            self.nc.title = 'Atmospheric soundings'
+            self.nc.history = 'written by wyominglib.py'
+        self.times = set(self.nc['time'][:].tolist())
+
+    def append(self, thetime, dataframe, attr_dict=None):
+        """
+        Queue one sounding for the end of the file
+
+        Soundings whose time is already in the file are skipped
+        (a ragged array cannot be rewritten in place). Returns
+        True if the sounding will be written.
+        """
+        stamp = float(pd.Timestamp(thetime).value // 10**9)
+        if stamp in self.times:
+            return False
+        if attr_dict:
+            self._set_attrs(dataframe, attr_dict)
+        self.times.add(stamp)
+        WriteBuffer.append(self, thetime, dataframe)
+        return True
+
+    def _write(self, soundings):
+        """ one slice of every variable """
+        nc = self.nc
+        n = len(nc.dimensions['time'])
+        start = len(nc.dimensions['obs'])
+        sizes = [len(df) for _, df in soundings]
+        stop = start + sum(sizes)
+        columns = soundings[0][1].columns
+        for name in columns:
+            if name not in nc.variables:
+                var = nc.createVariable(name, np.float32, ('obs',),
+                                        fill_value=np.nan)
+                var.long_name = column_long_names.get(name, name)
+            if stop > start:
+                nc[name][start:stop] = np.concatenate(
+                    [df[name].values for _, df in soundings])
+        nc['time'][n:n + len(soundings)] = [t.value // 10**9
+                                            for t, _ in soundings]
+        nc['row_size'][n:n + len(soundings)] = sizes
+        nc.sync()
+
+    def _set_attrs(self, dataframe, attr_dict):
+        units = attr_dict.get('units', '').split(';')
+        for name, unit in zip(dataframe.columns, units):
+            if name in self.nc.variables:
+                continue
+            var = self.nc.createVariable(name, np.float32, ('obs',),
+                                         fill_value=np.nan)
+            var.long_name = column_long_names.get(name, name)
+            var.units = unit
+        for key in ['site_id', 'latitude', 'longitude', 'elevation']:
+            if key in attr_dict:
+                self.nc.setncattr(key, attr_dict[key])
+
+    def _close(self):
+        self.nc.close()
+
+
+def netcdf_name(out_name):
+    """ consolidated NetCDF file next to an hdf archive """
+    return os.path.splitext(out_name)[0] + '.nc'
+
+
+class PaddedNetCDF(WriteBuffer):
+    """
+    NetCDF file of soundings on a padded (time, level) grid,
+    appended along the unlimited time dimension
+
+    The file stays open while soundings are added; they are
+    buffered (see WriteBuffer) and written as one block per
+    variable. Both time and level are unlimited, so a sounding with
+    more levels than the file holds widens it; shorter soundings are
+    padded with NaN and ``nlevels`` keeps the level count of each.
+
+    Parameters
+    ----------
+
+    filename : str
+               NetCDF file
+
+    mode : str
+           'a' appends to an existing file, 'w' starts a new one
+
+    flush_every, max_bytes, max_seconds :
+           buffer limits (see WriteBuffer)
+    """
+
+    time_units = "seconds since 1970-01-01 00:00:00"
+
+    # dataframe column, variable name, units, description
+    variables = [('hght', 'height', 'm', 'height above sea level'),
+                 ('pres', 'pressure', 'hPa', None),
+                 ('temp', 'temperature', 'deg C', None),
+                 ('dwpt', 'dewpoint', 'deg C', None),
+                 ('relh', 'relative_humidity', 'RH', None),
+                 ('mixr', 'mixing_ratio', 'g kg^-1', None),
+                 ('drct', 'wind_dir', 'degrees', None),
+                 ('sknt', 'wind_speed', 'knots', None),
+                 ('thta', 'theta_a', 'K', None),
+                 ('thte', 'theta_e', 'K', None),
+                 ('thtv', 'theta_v', 'K', None)]
+
+    def __init__(self, filename, mode='a', flush_every=50, **limits):
+        from netCDF4 import Dataset
+        import datetime
+
+        WriteBuffer.__init__(self, flush_every, **limits)
+        self.filename = filename
+        if mode == 'a' and os.path.exists(filename):
+            self.nc = Dataset(filename, 'a')
+            return
+
+        nc = Dataset(filename, 'w', format='NETCDF4')
+        nc.createDimension('time', None)
+        nc.createDimension('level', None)
+
+        var_time = nc.createVariable('time', np.float64, ('time',))
+        var_time.description = 'Observation time'
+        var_time.units = self.time_units
+        var_time.calendar = "standard"
+        var_time.axis = "T"
+        var_n = nc.createVariable('nlevels', np.int32, ('time',))
+        var_n.description = 'number of levels of each sounding'
+        for _, name, units, description in self.variables:
+            var = nc.createVariable(name, np.float64, ('time', 'level'),
+                                    fill_value=np.nan)
+            var.units = units
+            if description is not None:
+                var.description = description
+        nc['height'].axis = "Y"
+
+        nc.title = 'Atmospheric soundings'
+        nc.creation_date = datetime.datetime.now().strftime("%d/%m/%Y %H:%M")
+        nc.environment = 'env:{}, numpy:{}'.format(sys.version,
+                                                   np.__version__)
+        self.nc = nc
+
+    def _write(self, soundings):
+        """ one block per variable """
+        from netCDF4 import date2num
+
+        nc = self.nc
+        start = len(nc.dimensions['time'])
+        stop = start + len(soundings)
+        sizes = [len(df) for _, df in soundings]
+        nlev = max(max(sizes), len(nc.dimensions['level']))
+
+        nc['time'][start:stop] = date2num(
+            [t.to_pydatetime() for t, _ in soundings], self.time_units)
+        nc['nlevels'][start:stop] = sizes
+        for column, name, _, _ in self.variables:
+            block = np.full((len(soundings), nlev), np.nan)
+            for row, (_, df) in enumerate(soundings):
+                block[row, :len(df)] = df[column].values
+            nc[name][start:stop, :nlev] = block
+        nc.sync()
+
+    def _close(self):
+        self.nc.close()
+
+
+def write_sounding_netcdf(filename,dataframe,time):
+    """
+    Write sounding data to netcdf files
+
+    Creates filename with a single sounding; use PaddedNetCDF to
+    append many soundings to one file
+    """
+    with PaddedNetCDF(filename, 'w') as nc:
+        nc.append(time, dataframe)
+
+
+def download_wyoming_netcdf(region=None, station=None, year=None,
+                     date=None, dates=None, out_directory=None,
+                     session=None, batch=None, workers=1,
+                     missing=None, queue_size=8, stream=False,
+                     errors=None, flush_every=50):
+    """
+    function to test downloading a sounding
+    from http://weather.uwyo.edu/cgi-bin/sounding and
+    creating one netcdf file (see PaddedNetCDF) with the
+    soundings that have all standard levels
+
+    see the notebook newsoundings.ipynb for use
+
+    session : WyomingSession, optional
+              pooled HTTP session shared across calls;
+              defaults to the module-wide session
+
+    batch : None, 'month' or int
+            request a whole month (or ``batch`` days) per HTTP
+            call instead of one request per date
+
+    workers : int
+              number of requests kept in flight
+
+    missing : wyoming_cache.MissingCache, optional
+              persistent record of 'NO SOUNDING' dates, which are
+              skipped without a request
+
+    queue_size : int
+                 size of the queues between the fetch, parse and
+                 write stages; 0 runs them one after another
+
+    stream : bool
+             with batch and workers=1, parse each window page
+             while it downloads (see fetch_soundings)
+
+    errors : ErrorReport, optional
+             soundings that fail to parse are recorded here and
+             the download carries on; without it a malformed
+             sounding raises ParseError
+
+    flush_every : int
+                  soundings buffered before each write to the
+                  NetCDF file
+    """
+
+    st_num = station['number']
+    st_name = station['name']
+
+    name_template = out_directory + '/wyoming_{0}_{1}_{2}_stdlevel.nc'
+
+    dates, out_name = station_dates(region, st_name, year=year,
+                                    date=date, dates=dates,
+                                    name_template=name_template)
+
+    # start downloading for each date
+    soundings = fetch_soundings(region, st_num, dates,
+                                session=session, batch=batch,
+                                workers=workers, missing=missing,
+                                stream=stream)
+    with PaddedNetCDF(out_name, 'w', flush_every=flush_every) as nc:
+        for date, at_dict, sounding_df, resp in pipeline(soundings,
+                                                         queue_size, errors):
+
+            if resp == 'OK':
+                attr_dict = at_dict
+            else:
+                attr_dict = dict()
+
+            print_sounding(date, resp)
+
+            if resp != 'OK':
+                continue
+            thetime = date.strftime("%Y%m%d%H")
+
+            # Find main levels
+            main_levels = [1000,925,850,700,500,400,300,200,100]
+
+            print(sounding_df.pres.values)
+
+            idx = np.where(np.isin(sounding_df.pres.values,main_levels))[0]
+            if len(idx) != len(main_levels):
+                print("Not all requestested levels ({}) available: {}".format(main_levels,sounding_df.pres.values))
+                continue
+
+            nc.append(date, sounding_df)
+
+            #r = xr.Dataset.from_dataframe(sounding_df)
+            #r.to_netcdf(out_name.split('.')[0]+'__'+thetime+'.nc')
+            #store.put(thetime, sounding_df, format='table')
 
-        write_sounding_netcdf("Sounding__BarbadosAirport__StdLevel__"+thetime+".nc",sounding_df.iloc[:],date)
-        
-        #r = xr.Dataset.from_dataframe(sounding_df)
-        #r.to_netcdf(out_name.split('.')[0]+'__'+thetime+'.nc')
-        #store.put(thetime, sounding_df, format='table')
+    print('netcdf file {} written'.format(out_name))
 
     attr_dict['history'] = "written by wyominglib.py"
     key_list = ['header', 'site_id', 'longitude', 'latitude',